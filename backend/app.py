@@ -1,232 +1,468 @@
 import os
-import json
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
+from starlette.routing import Route
 import httpx
+import orjson
 from dotenv import load_dotenv
-from search_service import search_service
+from pydantic import BaseModel, ConfigDict, ValidationError
+from search_service import search_service, rank_results_bm25
 from context_service import create_context_service
+from context_manager import load_token_encoding
+from llm_cache import llm_cache, llm_inflight
 
 load_dotenv()                       # load .env file
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
+logger = logging.getLogger(__name__)
+
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/chat")
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "qwen3:latest")
+MODEL_KEEP_ALIVE = "24h"
+KEEP_ALIVE_INTERVAL = 20 * 60  # re-ping every 20 minutes
+PREFETCH_BUFFER = 64  # synthesis chunks read ahead of the /search client
+
+# Ollama streams NDJSON; X-Accel-Buffering stops nginx-style proxies from holding chunks back
+STREAM_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
 
 app = FastAPI(title="Local LLM Proxy")
 
+def json_response(payload: Any) -> Response:
+    """Serialize a large response body with orjson, skipping FastAPI's jsonable_encoder pass"""
+    return Response(orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS), media_type="application/json")
+
+class ChatBody(BaseModel):
+    """Ollama /api/chat body; extra Ollama fields (options, format, ...) pass through"""
+    model_config = ConfigDict(extra="allow")
+
+    model: str
+    messages: List[Dict[str, Any]]
+    stream: bool = True
+
+class SearchBody(BaseModel):
+    query: str
+    model: str = "qwen3:latest"
+    max_results: int = 5
+
+class EnhancedSearchBody(SearchBody):
+    max_results: int = 3
+
 # Initialize context service
 context_service = create_context_service(OLLAMA_URL)
 
+@app.on_event("startup")
+async def startup():
+    # One pooled client for every Ollama call, so requests reuse open connections.
+    # HTTP/2 multiplexes concurrent streams when Ollama sits behind a TLS endpoint;
+    # plain http:// URLs stay on pooled HTTP/1.1 connections.
+    app.state.client = httpx.AsyncClient(
+        timeout=httpx.Timeout(120.0),
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+        http2=True,
+    )
+    app.state.keep_alive_task = asyncio.create_task(keep_model_loaded(app.state.client))
+    # The tokenizer may download its encoding file; load it off the event loop and
+    # let token counts use the character estimate until it is ready
+    app.state.encoding_load = asyncio.get_running_loop().run_in_executor(None, load_token_encoding)
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.keep_alive_task.cancel()
+    await app.state.client.aclose()
+    await context_service.aclose()
+    await search_service.aclose()
+
+async def keep_model_loaded(client: httpx.AsyncClient):
+    """Load the default model at startup and keep pinging so Ollama never unloads it"""
+    while True:
+        try:
+            # An empty messages list makes Ollama load the model without generating
+            response = await client.post(
+                OLLAMA_URL,
+                json={"model": DEFAULT_MODEL, "messages": [], "keep_alive": MODEL_KEEP_ALIVE},
+                timeout=300.0
+            )
+            response.raise_for_status()
+            logger.debug("Model %s loaded (keep_alive=%s)", DEFAULT_MODEL, MODEL_KEEP_ALIVE)
+        except httpx.HTTPError as e:
+            logger.warning("Could not preload model %s: %s", DEFAULT_MODEL, e)
+        await asyncio.sleep(KEEP_ALIVE_INTERVAL)
+
 @app.get("/")
 async def root():
-    print("[DEBUG] Root endpoint hit!")
+    logger.debug("Root endpoint hit")
     return {"message": "LLM Proxy Server", "version": "debug"}
 
 # Allow the Vite dev server (http://localhost:5173) to talk to us
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173", "http://localhost:5174"],
-    allow_methods=["GET", "POST", "DELETE"],
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    max_age=86400,  # let browsers cache preflight results for a day
 )
 
-@app.post("/chat")
-async def chat(request: Request):
+class ChatProxy:
     """
+    Raw ASGI endpoint for /chat. The route is a pure pass-through to Ollama, so it
+    skips FastAPI's dependency injection and request handling on the streaming path.
     Accepts the same JSON body that Ollama expects and forwards it with streaming enabled.
     """
-    body = await request.json()
-    # Basic validation: must contain `model` and `messages`
-    if "model" not in body or "messages" not in body:
-        raise HTTPException(status_code=400, detail="Missing required fields")
 
-    # Enable streaming
-    body["stream"] = True
+    async def __call__(self, scope, receive, send):
+        parts = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            parts.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+
+        try:
+            body = ChatBody.model_validate_json(b"".join(parts)).model_dump()
+        except ValidationError as e:
+            response = Response(
+                orjson.dumps({"detail": e.errors(include_url=False, include_context=False, include_input=False)}),
+                status_code=422,
+                media_type="application/json",
+            )
+            await response(scope, receive, send)
+            return
 
-    async def stream_response():
-        async with httpx.AsyncClient() as client:
-            try:
-                async with client.stream(
-                    "POST",
-                    OLLAMA_URL,
-                    json=body,
-                    timeout=120.0,
-                ) as resp:
-                    resp.raise_for_status()
-                    async for chunk in resp.aiter_text():
-                        if chunk:
-                            yield chunk
-            except httpx.HTTPError as exc:
-                error_response = f'{{"error": "Error contacting Ollama: {exc}"}}\n'
-                yield error_response
-
-    return StreamingResponse(
-        stream_response(),
-        media_type="text/plain",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
-    )
+        # Enable streaming
+        body["stream"] = True
 
-async def filter_results_with_llm(query: str, results: list, max_results: int, model: str) -> list:
+        # Ollama schedules concurrent requests itself, so forward each one directly
+        response = StreamingResponse(
+            proxy_stream(scope["app"].state.client, body),
+            media_type="application/x-ndjson",
+            headers=STREAM_HEADERS
+        )
+        await response(scope, receive, send)
+
+app.router.routes.append(Route("/chat", ChatProxy(), methods=["POST"]))
+
+# Added to the synthesis prompt when the model also picks which results to use
+_INLINE_RANKING = """Before answering, choose the {max_results} search results that best answer the question and output their numbers, most relevant first, on one line in exactly this form: <INDICES>[3, 1]</INDICES>
+Then answer using only those results.
+
+"""
+
+INDICES_OPEN = "<INDICES>"
+INDICES_CLOSE = "</INDICES>"
+INDICES_SCAN_LIMIT = 200  # answer characters to wait for the header before giving up
+
+def build_synthesis_body(query: str, model: str, search_results: list, select: int = 0) -> dict:
     """
-    Use LLM to filter and rank search results by relevance to the query
+    Build the Ollama request that answers the query from the search results. With
+    select > 0 the model first picks that many results in an <INDICES> header.
     """
-    if len(results) <= max_results:
-        return results
-    
-    # Create a prompt for the LLM to rank results
-    results_text = ""
-    for i, result in enumerate(results):
-        results_text += f"{i+1}. Title: {result['title']}\n"
-        results_text += f"   Snippet: {result['snippet']}\n"
-        results_text += f"   URL: {result['url']}\n\n"
+    # Prepare search context for LLM
+    if search_results:
+        search_context = "".join([
+            "Based on the following search results:\n\n",
+            *(
+                f"{i}. {result['title']}\n"
+                f"   URL: {result['url']}\n"
+                f"   Summary: {result['snippet']}\n\n"
+                for i, result in enumerate(search_results, 1)
+            ),
+        ])
+    else:
+        search_context = "No relevant search results were found for this query.\n\n"
     
-    ranking_prompt = f"""You are a search relevance expert. Given the user's query and a list of search results, identify the {max_results} most relevant results that best answer the user's question.
+    # Create the prompt for the LLM
+    llm_prompt = f"""You are a helpful assistant with access to current web search results. Please provide a conversational, natural answer to the user's question based on the search results provided.
+
+User's question: {query}
 
-User's query: "{query}"
+{search_context}
 
-Search results:
-{results_text}
+{_INLINE_RANKING.format(max_results=select) if select else ""}Please provide a direct, helpful answer based on this information. If the search results don't contain enough information to fully answer the question, acknowledge this and provide what information you can. Be conversational and natural in your response."""
+
+    return {
+        "model": model,
+        "messages": [{"role": "user", "content": llm_prompt}],
+        "stream": True
+    }
+
+def _error_line(exc: Exception) -> bytes:
+    return f'{{"error": "Error contacting Ollama: {exc}"}}\n'.encode()
+
+async def _ollama_stream(client: httpx.AsyncClient, body: dict) -> AsyncIterator[bytes]:
+    async with client.stream(
+        "POST",
+        OLLAMA_URL,
+        json=body,
+        timeout=120.0,
+    ) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.aiter_bytes():
+            if chunk:
+                yield chunk
+
+async def proxy_stream(client: httpx.AsyncClient, body: dict, prefix: bytes = b"") -> AsyncIterator[bytes]:
+    """Relay a streaming Ollama call, after an optional prefix, as NDJSON bytes"""
+    if prefix:
+        yield prefix
+    try:
+        async for chunk in _ollama_stream(client, body):
+            yield chunk
+    except httpx.HTTPError as exc:
+        yield _error_line(exc)
 
-Please respond with ONLY the numbers of the {max_results} most relevant results, separated by commas (e.g., "3,1,5"). Choose results that:
-1. Most directly answer the user's query
-2. Provide the most useful information
-3. Are from credible sources
+async def cached_stream(client: httpx.AsyncClient, body: dict) -> AsyncIterator[bytes]:
+    """
+    Like proxy_stream, but replays cached answers and shares one upstream call
+    between identical in-flight requests
+    """
+    cache_key = llm_cache.make_key(body)
+
+    # Replay a previously completed answer for the same prompt
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    async def fetch():
+        logger.debug("Calling Ollama with prompt length: %d", len(body["messages"][0]["content"]))
+        try:
+            chunks = []
+            async for chunk in _ollama_stream(client, body):
+                chunks.append(chunk)
+                yield chunk
+            llm_cache.set(cache_key, b"".join(chunks))
+        except httpx.HTTPError as exc:
+            yield _error_line(exc)
+
+    async for chunk in llm_inflight.stream(cache_key, fetch):
+        yield chunk
+
+class SynthesisPrefetch:
+    """
+    Runs cached_stream in the background and buffers its chunks, so the Ollama
+    request is already in flight while the caller sends other frames
+    """
 
-Your response (numbers only):"""
+    def __init__(self, client: httpx.AsyncClient, llm_body: dict):
+        # Bounded, so a slow client holds up the relay instead of buffering the whole answer
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=PREFETCH_BUFFER)
+        self._cancelled = False
+        self._task = asyncio.create_task(self._pump(client, llm_body))
+
+    async def _pump(self, client: httpx.AsyncClient, llm_body: dict):
+        try:
+            async for chunk in cached_stream(client, llm_body):
+                await self._queue.put(chunk)
+        finally:
+            # Wake the reader unless it has already gone away
+            if not self._cancelled:
+                await self._queue.put(None)
+
+    async def __aiter__(self):
+        while True:
+            chunk = await self._queue.get()
+            if chunk is None:
+                break
+            yield chunk
+        # Surface anything the background relay raised
+        await self._task
+
+    def cancel(self):
+        self._cancelled = True
+        if not self._task.done():
+            self._task.cancel()
+        elif not self._task.cancelled() and self._task.exception() is not None:
+            # Retrieved here too, for a reader that stopped before reaching the error
+            logger.debug("Synthesis prefetch failed: %s", self._task.exception())
+
+def search_result_frames(query: str, search_results: list) -> List[bytes]:
+    """The /search preamble: a header frame, then one line per result"""
+    logger.debug("Sending search results: %d results", len(search_results))
+    frames = [orjson.dumps({
+        "type": "meta",
+        "query": query,
+        "result_count": len(search_results),
+        "done": False
+    }) + b"\n"]
+    frames.extend(orjson.dumps({"search_result": result, "done": False}) + b"\n" for result in search_results)
+    return frames
+
+def _find_indices(content: str, start: int, scan_from: int):
+    """
+    Look for the <INDICES> header in the held answer text, which begins at `start`;
+    text before `scan_from` is known not to hold the header. Returns the header's
+    (start, end, numbers), False once it clearly isn't coming, or None to keep waiting,
+    together with the offset to resume scanning from when more text arrives.
+    """
+    open_at = content.find(INDICES_OPEN, scan_from)
+    if open_at < 0:
+        # Keep room for an opening tag split across lines
+        resume = max(scan_from, len(content) - len(INDICES_OPEN) + 1)
+        return (False if len(content) - start > INDICES_SCAN_LIMIT else None), resume
+    close_at = content.find(INDICES_CLOSE, open_at)
+    if close_at < 0:
+        return (False if len(content) - open_at > INDICES_SCAN_LIMIT else None), open_at
 
     try:
-        # Make a quick LLM request to rank results
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                OLLAMA_URL,
-                json={
-                    "model": model,
-                    "messages": [{"role": "user", "content": ranking_prompt}],
-                    "stream": False
-                },
-                timeout=30.0
-            )
-            response.raise_for_status()
-            
-            ranking_response = response.json()
-            selected_numbers = ranking_response.get("message", {}).get("content", "").strip()
-            print(f"[DEBUG] LLM ranking response: {selected_numbers}")
-            
-            # Parse the selected numbers
+        numbers = orjson.loads(content[open_at + len(INDICES_OPEN):close_at])
+    except ValueError:
+        numbers = []
+    end = close_at + len(INDICES_CLOSE)
+    end += len(content[end:]) - len(content[end:].lstrip())
+    return (open_at, end, numbers), open_at
+
+async def stream_with_inline_ranking(source: AsyncIterator[bytes], query: str,
+                                     candidates: list, max_results: int) -> AsyncIterator[bytes]:
+    """
+    Hold back the synthesis stream until the model's <INDICES> header arrives, send the
+    results it picked, then replay the held lines with the header cut out of the content.
+    A leading <think> block can't contain the header, so its lines go out as they arrive.
+    """
+    held = []  # (parsed line, raw line, offset of its content in the held text)
+    content = ""  # answer text of the held lines
+    start = 0  # where the answer proper begins in content, past any </think>
+    scan_from = 0  # content before this has already been searched for the header
+    thinking = False
+    buffer = b""
+    async for chunk in source:
+        if held is None:
+            yield chunk
+            continue
+
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for n, line in enumerate(lines):
+            if not line.strip():
+                continue
             try:
-                selected_indices = [int(x.strip()) - 1 for x in selected_numbers.split(",") if x.strip().isdigit()]
-                # Ensure indices are valid and limit to max_results
-                valid_indices = [i for i in selected_indices if 0 <= i < len(results)][:max_results]
-                
-                if valid_indices:
-                    filtered_results = [results[i] for i in valid_indices]
-                    print(f"[DEBUG] Selected indices: {valid_indices}")
-                    return filtered_results
-                else:
-                    print("[DEBUG] No valid indices, falling back to first results")
-                    return results[:max_results]
-                    
-            except (ValueError, IndexError) as e:
-                print(f"[DEBUG] Error parsing LLM response: {e}, falling back to first results")
-                return results[:max_results]
-                
-    except Exception as e:
-        print(f"[DEBUG] Error in LLM filtering: {e}, falling back to first results")
-        return results[:max_results]
+                data = orjson.loads(line)
+            except ValueError:
+                data = {}
+            text = (data.get("message") or {}).get("content") or ""
+
+            if not held and "<think>" in text:
+                thinking = True
+            think_end = text.find("</think>") if thinking else -1
+            if thinking and think_end < 0 and not data.get("done"):
+                yield line + b"\n"
+                continue
+            if think_end >= 0:
+                thinking = False
+                start = scan_from = len(content) + think_end + len("</think>")
+
+            held.append((data, line, len(content)))
+            content += text
+
+            found, scan_from = _find_indices(content, start, scan_from)
+            if found is None and not data.get("done"):
+                continue
+
+            for frame in _release_held(query, candidates, max_results, held, found):
+                yield frame
+            rest = b"".join(later + b"\n" for later in lines[n + 1:]) + buffer
+            if rest:
+                yield rest
+            held = None
+            break
+
+    if held is not None:
+        # Stream ended without a header (e.g. an error line): keep the local ranking
+        for frame in _release_held(query, candidates, max_results, held, None):
+            yield frame
+        if buffer:
+            yield buffer
+
+def _release_held(query: str, candidates: list, max_results: int, held: list, found) -> List[bytes]:
+    span = None
+    selected = []
+    if found:
+        span = found[:2]
+        numbers = found[2] if isinstance(found[2], list) else []
+        picked = [x - 1 for x in numbers if isinstance(x, int) and 0 < x <= len(candidates)]
+        selected = [candidates[i] for i in dict.fromkeys(picked)][:max_results]
+        logger.debug("Inline ranking picked: %s", picked)
+    if not selected:
+        logger.debug("No usable inline ranking, keeping local order")
+        selected = candidates[:max_results]
+
+    frames = search_result_frames(query, selected)
+    for data, line, offset in held:
+        text = (data.get("message") or {}).get("content") or ""
+        if span is None or not text:
+            frames.append(line + b"\n")
+            continue
+        cut_from = min(max(span[0] - offset, 0), len(text))
+        cut_to = min(max(span[1] - offset, 0), len(text))
+        if cut_from == cut_to:
+            frames.append(line + b"\n")
+            continue
+        remaining = text[:cut_from] + text[cut_to:]
+        if remaining or data.get("done"):
+            data["message"]["content"] = remaining
+            frames.append(orjson.dumps(data) + b"\n")
+    return frames
 
 @app.post("/search")
-async def web_search_with_chat(request: Request):
+async def web_search_with_chat(body: SearchBody, request: Request):
     """
     Perform web search and synthesize results with LLM for conversational response
     """
-    print("[DEBUG] /search endpoint hit! v2")
-    body = await request.json()
-    query = body.get("query", "").strip()
-    model = body.get("model", "qwen3:latest")
-    max_results = body.get("max_results", 5)
-    print(f"[DEBUG] Query: {query}, Model: {model}, Max: {max_results}")
+    logger.debug("/search endpoint hit")
+    query = body.query.strip()
+    model = body.model
+    max_results = body.max_results
+    logger.debug("Query: %s, Model: %s, Max: %s", query, model, max_results)
     
     if not query:
         raise HTTPException(status_code=400, detail="Query parameter is required")
     
     try:
-        print(f"[DEBUG] Starting enhanced search for query: {query}")
+        logger.debug("Starting search for query: %s", query)
         # First, perform the search - get more results for filtering
         initial_results = await search_service.search(query, max(max_results * 2, 5))
-        print(f"[DEBUG] Found {len(initial_results)} initial search results")
-        
-        # Use LLM to filter and rank the most relevant results
-        filtered_results = await filter_results_with_llm(query, initial_results, max_results, model)
-        print(f"[DEBUG] Filtered to {len(filtered_results)} most relevant results")
+        logger.debug("Found %d initial search results", len(initial_results))
         
-        search_results = filtered_results
-        print(f"[DEBUG] About to create streaming response...")
-        
-        # Prepare search context for LLM
-        search_context = ""
-        if search_results:
-            search_context = "Based on the following search results:\n\n"
-            for i, result in enumerate(search_results, 1):
-                search_context += f"{i}. {result['title']}\n"
-                search_context += f"   URL: {result['url']}\n"
-                search_context += f"   Summary: {result['snippet']}\n\n"
-        else:
-            search_context = "No relevant search results were found for this query.\n\n"
-        
-        # Create the prompt for the LLM
-        llm_prompt = f"""You are a helpful assistant with access to current web search results. Please provide a conversational, natural answer to the user's question based on the search results provided.
+        client = request.app.state.client
 
-User's question: {query}
-
-{search_context}
-
-Please provide a direct, helpful answer based on this information. If the search results don't contain enough information to fully answer the question, acknowledge this and provide what information you can. Be conversational and natural in your response."""
-
-        # Prepare the request for Ollama
-        llm_body = {
-            "model": model,
-            "messages": [{"role": "user", "content": llm_prompt}],
-            "stream": True
-        }
+        # Rank locally first; only ask the LLM when the top results aren't clearly separated
+        ranked_results, confident = rank_results_bm25(query, initial_results, max_results)
 
         # Stream the LLM response
         async def stream_response():
-            # First, send search results as a special message
-            search_data = {
-                "search_results": search_results,
-                "query": query,
-                "message": {"role": "assistant", "content": ""},
-                "done": False
-            }
-            print(f"[DEBUG] Sending search results: {len(search_results)} results")
-            yield f"{json.dumps(search_data)}\n"
-            
-            print(f"[DEBUG] About to call Ollama with prompt length: {len(llm_prompt)}")
-            async with httpx.AsyncClient() as client:
-                try:
-                    async with client.stream(
-                        "POST",
-                        OLLAMA_URL,
-                        json=llm_body,
-                        timeout=120.0,
-                    ) as resp:
-                        resp.raise_for_status()
-                        async for chunk in resp.aiter_text():
-                            if chunk:
-                                yield chunk
-                except httpx.HTTPError as exc:
-                    error_response = f'{{"error": "Error contacting Ollama: {exc}"}}\n'
-                    yield error_response
+            if not confident:
+                # One call both picks the results (as an <INDICES> header) and answers
+                candidates = ranked_results[:max_results * 2]
+                llm_body = build_synthesis_body(query, model, candidates, select=max_results)
+                async for chunk in stream_with_inline_ranking(
+                    cached_stream(client, llm_body), query, candidates, max_results
+                ):
+                    yield chunk
+                return
+
+            logger.debug("Local ranking is decisive, skipping LLM ranking")
+            search_results = ranked_results[:max_results]
+            # Start synthesis before sending the results so Ollama works while they go out
+            synthesis = SynthesisPrefetch(client, build_synthesis_body(query, model, search_results))
+            try:
+                for frame in search_result_frames(query, search_results):
+                    yield frame
+                async for chunk in synthesis:
+                    yield chunk
+            finally:
+                synthesis.cancel()
 
         return StreamingResponse(
             stream_response(),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-            }
+            media_type="application/x-ndjson",
+            headers=STREAM_HEADERS
         )
         
     except Exception as e:
@@ -263,60 +499,58 @@ Conversation:
 Essential context (name, current topic, key facts only):"""
 
         # Send to LLM for summarization
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                OLLAMA_URL,
-                json={
-                    "model": model,
-                    "messages": [{"role": "user", "content": summary_prompt}],
-                    "stream": False
-                },
-                timeout=60.0
-            )
-            response.raise_for_status()
-            
-            summary_response = response.json()
-            summary = summary_response.get("message", {}).get("content", "").strip()
-            
-            return {
-                "summary": summary,
-                "original_message_count": len(messages),
-                "success": True
-            }
-            
+        response = await request.app.state.client.post(
+            OLLAMA_URL,
+            json={
+                "model": model,
+                "messages": [{"role": "user", "content": summary_prompt}],
+                "stream": False
+            },
+            timeout=60.0
+        )
+        response.raise_for_status()
+        
+        summary_response = response.json()
+        summary = summary_response.get("message", {}).get("content", "").strip()
+        
+        return {
+            "summary": summary,
+            "original_message_count": len(messages),
+            "success": True
+        }
+        
     except Exception as e:
-        print(f"[DEBUG] Error in conversation summarization: {e}")
+        logger.error("Error in conversation summarization: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Summarization failed: {str(e)}"
         )
 
 @app.post("/search-enhanced")
-async def enhanced_search(request: Request):
+async def enhanced_search(body: EnhancedSearchBody, request: Request):
     """
     Enhanced search with conversational response (new endpoint for testing)
     """
-    body = await request.json()
-    query = body.get("query", "").strip()
-    model = body.get("model", "qwen3:latest")
-    max_results = body.get("max_results", 3)
+    query = body.query.strip()
+    model = body.model
+    max_results = body.max_results
     
     if not query:
         raise HTTPException(status_code=400, detail="Query parameter is required")
     
     try:
-        print(f"[ENHANCED] Starting search for: {query}")
+        logger.debug("[ENHANCED] Starting search for: %s", query)
         
         # Perform the search
         search_results = await search_service.search(query, max_results)
-        print(f"[ENHANCED] Found {len(search_results)} results")
+        logger.debug("[ENHANCED] Found %d results", len(search_results))
         
         # Simple synthesis prompt
         prompt = f"Based on these search results, please answer the question '{query}' in a conversational way:\n\n"
         for i, result in enumerate(search_results, 1):
             prompt += f"{i}. {result['title']}: {result['snippet']}\n"
         
-        print(f"[ENHANCED] Sending to Ollama...")
+        logger.debug("[ENHANCED] Sending to Ollama")
         
         # Send to Ollama with streaming
         llm_body = {
@@ -325,34 +559,14 @@ async def enhanced_search(request: Request):
             "stream": True
         }
 
-        async def stream_response():
-            async with httpx.AsyncClient() as client:
-                try:
-                    async with client.stream(
-                        "POST",
-                        OLLAMA_URL,
-                        json=llm_body,
-                        timeout=120.0,
-                    ) as resp:
-                        resp.raise_for_status()
-                        async for chunk in resp.aiter_text():
-                            if chunk:
-                                yield chunk
-                except Exception as e:
-                    print(f"[ENHANCED] Error: {e}")
-                    yield f'{{"error": "Error: {e}"}}\n'
-
         return StreamingResponse(
-            stream_response(),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-            }
+            cached_stream(request.app.state.client, llm_body),
+            media_type="application/x-ndjson",
+            headers=STREAM_HEADERS
         )
         
     except Exception as e:
-        print(f"[ENHANCED] Exception: {e}")
+        logger.error("[ENHANCED] Exception: %s", e)
         raise HTTPException(status_code=500, detail=f"Enhanced search failed: {str(e)}")
 
 # Enhanced Context Management Endpoints
@@ -392,47 +606,36 @@ async def enhanced_chat(request: Request):
             "stream": True
         }
         
+        client = request.app.state.client
+
         async def stream_response():
-            assistant_content = ""
-            
-            async with httpx.AsyncClient() as client:
-                try:
-                    async with client.stream(
-                        "POST",
-                        OLLAMA_URL,
-                        json=enhanced_body,
-                        timeout=120.0,
-                    ) as resp:
-                        resp.raise_for_status()
-                        async for chunk in resp.aiter_text():
-                            if chunk:
-                                # Accumulate assistant response
-                                try:
-                                    data = json.loads(chunk)
-                                    if data.get("message", {}).get("content"):
-                                        assistant_content += data["message"]["content"]
-                                except:
-                                    pass
-                                
-                                yield chunk
-                                
-                        # Add assistant response to context after completion
-                        if assistant_content:
-                            await context_service.add_message_to_context(
-                                session_id, "assistant", assistant_content, model
-                            )
-                            
-                except httpx.HTTPError as exc:
-                    error_response = f'{{"error": "Error contacting Ollama: {exc}"}}\n'
-                    yield error_response
+            assistant_content = []
+            buffer = b""
+            async for chunk in proxy_stream(client, enhanced_body):
+                yield chunk
+
+                # Accumulate assistant response
+                buffer += chunk
+                lines = buffer.split(b"\n")
+                buffer = lines.pop()
+                for line in lines:
+                    try:
+                        content = orjson.loads(line).get("message", {}).get("content")
+                    except (ValueError, AttributeError):
+                        continue
+                    if content:
+                        assistant_content.append(content)
+
+            # Add assistant response to context after completion
+            if assistant_content:
+                await context_service.add_message_to_context(
+                    session_id, "assistant", "".join(assistant_content), model
+                )
 
         return StreamingResponse(
             stream_response(),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-            }
+            media_type="application/x-ndjson",
+            headers=STREAM_HEADERS
         )
         
     except Exception as e:
@@ -461,7 +664,7 @@ async def add_message_to_context(request: Request):
 async def get_context_stats(session_id: str):
     """Get context statistics for a session"""
     try:
-        stats = context_service.get_context_stats(session_id)
+        stats = await context_service.get_context_stats(session_id)
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get stats: {str(e)}")
@@ -484,7 +687,7 @@ async def force_context_condensation(request: Request):
 async def get_session_memory(session_id: str):
     """Get session memory details"""
     try:
-        memory = context_service.get_session_memory(session_id)
+        memory = await context_service.get_session_memory(session_id)
         return memory
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get memory: {str(e)}")
@@ -498,7 +701,7 @@ async def update_session_memory(request: Request):
     memory_updates = body.get("updates", {})
     
     try:
-        result = context_service.update_session_memory(session_id, memory_updates)
+        result = await context_service.update_session_memory(session_id, memory_updates)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update memory: {str(e)}")
@@ -517,7 +720,7 @@ async def semantic_search_context(request: Request):
     
     try:
         results = await context_service.semantic_search_context(session_id, query, max_results)
-        return results
+        return json_response(results)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Context search failed: {str(e)}")
 
@@ -525,8 +728,8 @@ async def semantic_search_context(request: Request):
 async def get_conversation_history(session_id: str, limit: int = None):
     """Get conversation history"""
     try:
-        history = context_service.get_conversation_history(session_id, limit)
-        return history
+        history = await context_service.get_conversation_history(session_id, limit)
+        return json_response(history)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get history: {str(e)}")
 
@@ -544,7 +747,7 @@ async def get_all_sessions():
     """Get information about all active sessions"""
     try:
         sessions = context_service.get_all_sessions()
-        return sessions
+        return json_response(sessions)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get sessions: {str(e)}")
 
@@ -552,8 +755,8 @@ async def get_all_sessions():
 async def get_context_hygiene_report(session_id: str):
     """Get context hygiene report for a session"""
     try:
-        report = context_service.get_hygiene_report(session_id)
-        return report
+        report = await context_service.get_hygiene_report(session_id)
+        return json_response(report)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get hygiene report: {str(e)}")
 
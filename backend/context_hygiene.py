@@ -5,87 +5,209 @@ Implements validation, sanitization, and safety checks for context management
 
 import re
 import json
-from typing import List, Dict, Any, Optional, Tuple
-from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, Callable, ClassVar, Set, FrozenSet, NamedTuple
 import logging
 from datetime import datetime, timedelta
 
+try:
+    # Optional: pyahocorasick finds every literal keyword in a single pass
+    import ahocorasick  # type: ignore[import-not-found]
+except ImportError:
+    ahocorasick = None
+
 logger = logging.getLogger(__name__)
 
-@dataclass
-class ValidationResult:
+_SURROGATE_RE = re.compile('[' + chr(0xD800) + '-' + chr(0xDFFF) + ']')
+# Case-insensitive keyword searches, so message content isn't lowercased first
+_CONSTRAINT_RE = re.compile(r'constraint|decision', re.IGNORECASE)
+_SUMMARY_RE = re.compile(r'summary|context', re.IGNORECASE)
+
+class ValidationResult(NamedTuple):
+    # A tuple subclass: no per-instance __dict__, and clean messages share _EMPTY
     is_valid: bool
-    issues: List[str]
-    warnings: List[str]
-    sanitized_content: str = None
+    issues: Tuple[str, ...]
+    warnings: Tuple[str, ...]
+    sanitized_content: Optional[str] = None
+
+_EMPTY: Tuple[str, ...] = ()
 
 class ContextHygiene:
     """
     Implements context hygiene rules and guardrails
     """
+
+    # Opposing keywords used to spot contradictory constraints
+    OPPOSING_PAIRS: ClassVar[Tuple[Tuple[str, str], ...]] = (
+        ('must', 'must not'),
+        ('should', 'should not'),
+        ('always', 'never'),
+        ('required', 'forbidden'),
+        ('use', 'avoid'),
+        ('include', 'exclude')
+    )
+    # Opposing words that make two fact values contradict
+    CONTRADICTORY_VALUES: ClassVar[Tuple[Tuple[str, str], ...]] = (
+        ('yes', 'no'), ('true', 'false'), ('enabled', 'disabled'),
+        ('on', 'off'), ('allow', 'deny'), ('accept', 'reject')
+    )
+    # One bit per pair, so keyword presence is compared with a single AND
+    _OPPOSING_BITS: ClassVar[Tuple[int, ...]] = tuple(1 << i for i in range(len(OPPOSING_PAIRS)))
+    _CONTRADICTORY_BITS: ClassVar[Tuple[int, ...]] = tuple(1 << i for i in range(len(CONTRADICTORY_VALUES)))
+    VALID_ROLES: ClassVar[FrozenSet[str]] = frozenset(('system', 'user', 'assistant'))
+    # Longest text a cut can leave unredacted at its end: the most a sensitive
+    # pattern can span before its partial match still redacts (a 19-char card number)
+    _CUT_MARGIN: ClassVar[int] = 32
+    CONVERSATION_ROLES: ClassVar[FrozenSet[str]] = frozenset(('user', 'assistant'))
     
-    def __init__(self):
+    def __init__(self) -> None:
+        # Patterns are compiled once here rather than re-parsed on every message
+
         # Content safety patterns
         self.sensitive_patterns = [
             r'\b(?:password|token|secret|key|api_key)\s*[:=]\s*\S+',
             r'\b(?:credit card|ssn|social security)\b',
-            r'\b\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4}\b',  # Credit card patterns
-            r'\b\d{3}-\d{2}-\d{4}\b',  # SSN pattern
         ]
-        
-        # Topic coherence patterns
-        self.topic_shift_indicators = [
-            r'\b(?:now let\'s|moving on|switching to|different topic)\b',
-            r'\b(?:by the way|btw|off topic|unrelated)\b',
-            r'\b(?:new question|different question|change of subject)\b'
+        # One alternation, so redacting is a single pass over the text
+        self._sensitive_re = re.compile(
+            "|".join(f"(?:{p})" for p in self.sensitive_patterns), re.IGNORECASE
+        )
+        # Digit-group patterns with the fewest digits each can match; they only
+        # run on text that has at least that many
+        self.numeric_sensitive_patterns = [
+            (r'\b\d{4}[-\s]?\d{4}[-\s]?\d{4}[-\s]?\d{4}\b', 16),  # Credit card patterns
+            (r'\b\d{3}-\d{2}-\d{4}\b', 9),  # SSN pattern
+        ]
+        self._numeric_sensitive = [
+            (re.compile(p), min_digits) for p, min_digits in self.numeric_sensitive_patterns
         ]
         
-        # Quality control patterns
+        # Topic coherence phrases, checked as plain substrings first; the regex
+        # only confirms word boundaries for messages that contain one
+        self.topic_shift_phrases = (
+            "now let's", "moving on", "switching to", "different topic",
+            "by the way", "btw", "off topic", "unrelated",
+            "new question", "different question", "change of subject",
+        )
+        self._topic_shift_re = re.compile(
+            r"\b(?:" + "|".join(re.escape(p) for p in self.topic_shift_phrases) + r")\b",
+            re.IGNORECASE
+        )
+        
+        # Quality control: single word responses and filler words (optionally
+        # followed by a period) are looked up directly
+        self.low_quality_words = frozenset({
+            'ok', 'okay', 'yes', 'no', 'sure', 'thanks', 'thank you',
+            'lol', 'haha', 'hmm', 'uh', 'um', 'er',
+        })
+        self._low_quality_word_len = max(len(w) for w in self.low_quality_words) + 1
         self.low_quality_patterns = [
-            r'^(?:ok|okay|yes|no|sure|thanks|thank you)\.?$',  # Single word responses
-            r'^(?:lol|haha|hmm|uh|um|er)\.?$',  # Filler words
-            r'^\.{3,}$',  # Just dots
-            r'^[!@#$%^&*()]{3,}$',  # Just special characters
+            r'\.{3,}',  # Just dots
+            r'[!@#$%^&*()]{3,}',  # Just special characters
         ]
+        # Whole-message patterns: one alternation applied with fullmatch, and only
+        # to messages that start with one of these characters
+        self._low_quality_re = re.compile("|".join(f"(?:{p})" for p in self.low_quality_patterns))
+        self._low_quality_start = frozenset('.!@#$%^&*()')
+
+        # Literal keywords (topic-shift phrases, opposing and contradictory words)
+        self._keyword_automaton = self._build_keyword_automaton()
+
+        # Keyword extraction for topic-shift and contradiction checks
+        self._word_re = re.compile(r'\b\w{4,}\b')
         
         # Context size thresholds
         self.max_message_length = 10000  # 10k characters per message
         self.max_chunk_size = 500  # 500 characters per context chunk
         self.min_chunk_size = 20   # Minimum meaningful chunk size
+
+        # Validation only depends on (content, role), and context building plus
+        # hygiene reports re-validate the same history on every call
+        self._validate_cached = lru_cache(maxsize=2048)(self._validate_message)
         
+    def _redact(self, text: str) -> Tuple[str, int]:
+        """Replace sensitive information with a placeholder; returns the text and match count"""
+        text, count = self._sensitive_re.subn("[REDACTED]", text)
+
+        # Most messages hold few digits. Count ASCII digits with str.count (\d also
+        # matches other scripts' digits, so non-ASCII text always gets the regexes)
+        digits = sum(map(text.count, '0123456789')) if text.isascii() else None
+        for pattern, min_digits in self._numeric_sensitive:
+            if digits is None or digits >= min_digits:
+                text, found = pattern.subn("[REDACTED]", text)
+                count += found
+        return text, count
+
+    def _build_keyword_automaton(self) -> Any:
+        if ahocorasick is None:
+            return None
+        keywords = set(self.topic_shift_phrases)
+        for pair in self.OPPOSING_PAIRS + self.CONTRADICTORY_VALUES:
+            keywords.update(pair)
+        automaton = ahocorasick.Automaton()
+        for keyword in keywords:
+            automaton.add_word(keyword, keyword)
+        automaton.make_automaton()
+        return automaton
+
+    def _keyword_lookup(self, text_lower: str) -> Callable[[str], bool]:
+        """
+        Return a `keyword in text` test for the literal keywords. With pyahocorasick
+        the text is scanned once up front; otherwise each test is a substring search.
+        """
+        if self._keyword_automaton is None:
+            return text_lower.__contains__
+        return {keyword for _, keyword in self._keyword_automaton.iter(text_lower)}.__contains__
+
     def validate_message(self, content: str, role: str) -> ValidationResult:
-        """Validate a single message for content safety and quality"""
-        issues = []
-        warnings = []
+        """
+        Validate a single message for content safety and quality. Results are
+        cached and shared between callers, so treat them as read-only.
+        """
+        return self._validate_cached(content, role)
+
+    def _validate_message(self, content: str, role: str) -> ValidationResult:
+        # Tuples grow only when something is found, so clean messages allocate nothing
+        issues = _EMPTY
+        warnings = _EMPTY
         sanitized_content = content
         
         # Basic validation
         if not content or not content.strip():
-            issues.append("Empty or whitespace-only content")
+            issues += ("Empty or whitespace-only content",)
             return ValidationResult(False, issues, warnings)
         
-        # Length validation
-        if len(content) > self.max_message_length:
-            warnings.append(f"Message exceeds recommended length ({len(content)} > {self.max_message_length})")
-            sanitized_content = content[:self.max_message_length] + "... [truncated]"
+        # Length validation; truncate first so the scans below are bounded by
+        # max_message_length however long the input is
+        working = content
+        truncated = len(content) > self.max_message_length
+        if truncated:
+            warnings += (f"Message exceeds recommended length ({len(content)} > {self.max_message_length})",)
+            working = content[:self.max_message_length]
         
         # Sensitive information detection
-        for pattern in self.sensitive_patterns:
-            if re.search(pattern, content, re.IGNORECASE):
-                issues.append("Potentially sensitive information detected")
-                # Replace with placeholder
-                sanitized_content = re.sub(pattern, "[REDACTED]", sanitized_content, flags=re.IGNORECASE)
+        # Replace with placeholder
+        sanitized_content, redactions = self._redact(working)
+        if redactions:
+            issues += ("Potentially sensitive information detected",)
+        if truncated:
+            sanitized_content += "... [truncated]"
         
         # Quality checks for user messages
         if role == "user":
-            if re.match(r'|'.join(self.low_quality_patterns), content.strip(), re.IGNORECASE):
-                warnings.append("Low-quality or very short message detected")
-        
-        # Character encoding validation
-        try:
-            content.encode('utf-8')
-        except UnicodeEncodeError:
-            issues.append("Invalid character encoding")
+            stripped = working.strip()
+            word = stripped.lower() if len(stripped) <= self._low_quality_word_len else ''
+            if word.endswith('.'):
+                word = word[:-1]
+            if word in self.low_quality_words or (
+                stripped[:1] in self._low_quality_start and self._low_quality_re.fullmatch(stripped)
+            ):
+                warnings += ("Low-quality or very short message detected",)
+        
+        # Character encoding validation: a str only fails to encode as UTF-8 if it
+        # holds lone surrogates, and ASCII text can't
+        if not working.isascii() and _SURROGATE_RE.search(working):
+            issues += ("Invalid character encoding",)
         
         is_valid = len(issues) == 0
         return ValidationResult(is_valid, issues, warnings, sanitized_content)
@@ -98,21 +220,21 @@ class ContextHygiene:
         latest_message = recent_messages[-1].get('content', '')
         
         # Check for explicit topic shift indicators
-        for pattern in self.topic_shift_indicators:
-            if re.search(pattern, latest_message, re.IGNORECASE):
+        latest_lower = latest_message.lower()
+        contains = self._keyword_lookup(latest_lower)
+        if any(contains(phrase) for phrase in self.topic_shift_phrases):
+            if self._topic_shift_re.search(latest_message):
                 return True
         
         # Simple keyword-based topic shift detection
         if len(recent_messages) >= 3:
-            # Get keywords from last 3 messages
-            all_words = []
-            for msg in recent_messages[-3:]:
-                words = re.findall(r'\b\w{4,}\b', msg.get('content', '').lower())
-                all_words.extend(words)
+            # Get keywords from last 3 messages, tokenizing each message once
+            previous_words = set()
+            for msg in recent_messages[-3:-1]:
+                previous_words.update(self._word_re.findall(msg.get('content', '').lower()))
             
             # Check if latest message shares few keywords with previous messages
-            latest_words = set(re.findall(r'\b\w{4,}\b', latest_message.lower()))
-            previous_words = set(all_words[:-len(latest_words)])
+            latest_words = set(self._word_re.findall(latest_lower))
             
             if latest_words and previous_words:
                 overlap = len(latest_words.intersection(previous_words))
@@ -123,80 +245,111 @@ class ContextHygiene:
     
     def sanitize_context_chunk(self, chunk_content: str) -> str:
         """Sanitize context chunk content"""
+        # Cut oversized input before the regex passes, leaving slack for the
+        # whitespace collapse below
+        limit = self.max_chunk_size * 2
+        truncated = len(chunk_content) > limit
+        working = chunk_content[:limit] if truncated else chunk_content
+
         # Remove excessive whitespace
-        sanitized = re.sub(r'\s+', ' ', chunk_content.strip())
+        sanitized = ' '.join(working.split())
         
         # Remove sensitive patterns
-        for pattern in self.sensitive_patterns:
-            sanitized = re.sub(pattern, "[REDACTED]", sanitized, flags=re.IGNORECASE)
+        sanitized, _ = self._redact(sanitized)
+        
+        # A value split by the cut escapes the regexes but can only sit in the last
+        # _CUT_MARGIN characters. Whitespace-heavy input can collapse so far that
+        # those reach the returned window; then redact the whole input instead
+        if truncated and len(sanitized) < self.max_chunk_size + self._CUT_MARGIN:
+            sanitized, _ = self._redact(' '.join(chunk_content.split()))
+            truncated = False
         
         # Truncate if too long
         if len(sanitized) > self.max_chunk_size:
             sanitized = sanitized[:self.max_chunk_size] + "..."
+        elif truncated:
+            sanitized += "..."
         
         return sanitized
     
     def validate_context_structure(self, context_messages: List[Dict[str, str]]) -> ValidationResult:
         """Validate the overall context structure"""
-        issues = []
-        warnings = []
+        issues: List[str] = []
+        warnings: List[str] = []
         
         if not context_messages:
-            issues.append("Empty context")
-            return ValidationResult(False, issues, warnings)
+            return ValidationResult(False, ("Empty context",), _EMPTY)
         
-        # Check for valid message structure
+        # One pass: message structure, conversation flow and total size
+        flow_warnings: List[str] = []
+        previous_role = None
+        total_chars = 0
         for i, msg in enumerate(context_messages):
+            role = msg.get('role')
+            content = msg.get('content', '')
+
+            # Check for valid message structure
             if 'role' not in msg or 'content' not in msg:
                 issues.append(f"Message {i} missing required fields")
             
-            if msg.get('role') not in ['system', 'user', 'assistant']:
-                warnings.append(f"Message {i} has unusual role: {msg.get('role')}")
-        
-        # Check for reasonable conversation flow
-        roles = [msg.get('role') for msg in context_messages if msg.get('role') in ['user', 'assistant']]
-        
-        # Look for role alternation breaks
-        for i in range(1, len(roles)):
-            if roles[i] == roles[i-1] and roles[i] in ['user', 'assistant']:
-                warnings.append(f"Unusual conversation flow: consecutive {roles[i]} messages")
+            if role not in self.VALID_ROLES:
+                warnings.append(f"Message {i} has unusual role: {role}")
+            
+            # Look for role alternation breaks between user/assistant turns
+            if role in self.CONVERSATION_ROLES:
+                if role == previous_role:
+                    flow_warnings.append(f"Unusual conversation flow: consecutive {role} messages")
+                previous_role = role
+
+            total_chars += len(content)
+        warnings.extend(flow_warnings)
         
         # Check total context size
-        total_chars = sum(len(msg.get('content', '')) for msg in context_messages)
         if total_chars > 20000:  # 20k characters
             warnings.append(f"Large context size: {total_chars} characters")
         
         is_valid = len(issues) == 0
-        return ValidationResult(is_valid, issues, warnings)
+        return ValidationResult(is_valid, tuple(issues), tuple(warnings))
     
     def clean_conversation_history(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Clean and optimize conversation history"""
-        cleaned_messages = []
-        
+        return list(self.iter_clean_conversation_history(messages))
+
+    def iter_clean_conversation_history(self, messages: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Yield cleaned messages one at a time. Messages that need no changes are
+        yielded as-is rather than copied.
+        """
+        validate = self._validate_cached  # same as validate_message, minus a call layer
         for msg in messages:
             # Validate and sanitize each message
             content = msg.get('content', '')
             role = msg.get('role', 'user')
             
-            validation = self.validate_message(content, role)
+            validation = validate(content, role)
             
-            if validation.is_valid or validation.sanitized_content:
+            sanitized_content = validation.sanitized_content
+            if validation.is_valid or sanitized_content:
+                cleaned_content = sanitized_content or content
+                warnings, issues = validation.warnings, validation.issues
+                if not (warnings or issues) and cleaned_content == content:
+                    yield msg
+                    continue
+
                 cleaned_msg = msg.copy()
-                cleaned_msg['content'] = validation.sanitized_content or content
+                cleaned_msg['content'] = cleaned_content
                 
                 # Add metadata about cleaning
-                if validation.warnings or validation.issues:
+                if warnings or issues:
                     cleaned_msg['hygiene_notes'] = {
-                        'warnings': validation.warnings,
-                        'issues': validation.issues,
-                        'cleaned': bool(validation.sanitized_content)
+                        'warnings': warnings,
+                        'issues': issues,
+                        'cleaned': bool(sanitized_content)
                     }
                 
-                cleaned_messages.append(cleaned_msg)
+                yield cleaned_msg
             else:
-                logger.warning(f"Excluding message due to validation issues: {validation.issues}")
-        
-        return cleaned_messages
+                logger.warning("Excluding message due to validation issues: %s", validation.issues)
     
     def optimize_context_order(self, context_messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
         """Optimize context message ordering following best practices"""
@@ -207,13 +360,12 @@ class ContextHygiene:
         conversation_messages = []
         
         for msg in context_messages:
-            content = msg.get('content', '').lower()
-            role = msg.get('role', '')
-            
-            if role == 'system':
-                if 'constraint' in content or 'decision' in content:
+            if msg.get('role', '') == 'system':
+                # Only system messages need their content inspected
+                content = msg.get('content', '')
+                if _CONSTRAINT_RE.search(content):
                     constraint_messages.append(msg)
-                elif 'summary' in content or 'context' in content:
+                elif _SUMMARY_RE.search(content):
                     summary_messages.append(msg)
                 else:
                     system_messages.append(msg)
@@ -237,86 +389,102 @@ class ContextHygiene:
         constraints = session_memory.get('constraints_decisions', [])
         facts = session_memory.get('canonical_facts', {})
         
-        # Check for contradictory constraints
-        for i, constraint1 in enumerate(constraints):
-            for j, constraint2 in enumerate(constraints[i+1:], i+1):
-                if self._are_contradictory(constraint1, constraint2):
-                    conflicts.append(f"Contradictory constraints: {constraint1} vs {constraint2}")
-        
-        # Check for conflicting facts
-        for key, value in facts.items():
-            for other_key, other_value in facts.items():
-                if key != other_key and self._facts_conflict(key, value, other_key, other_value):
+        # Check for contradictory constraints. An inverted index from each opposing
+        # keyword to the constraints containing it means only pairs that share a
+        # (positive, negative) keyword pair are compared at all
+        lowered = [c.lower() for c in constraints]
+        masks = [self._opposing_masks(text) for text in lowered]
+        candidate_pairs: Set[Tuple[int, int]] = set()
+        for bit in self._OPPOSING_BITS:
+            pos_idx = [i for i, (pos_mask, _) in enumerate(masks) if pos_mask & bit]
+            if not pos_idx:
+                continue
+            neg_idx = [j for j, (_, neg_mask) in enumerate(masks) if neg_mask & bit]
+            candidate_pairs.update((i, j) for i in pos_idx for j in neg_idx if i < j)
+
+        token_sets: Dict[int, FrozenSet[str]] = {}
+        for i, j in sorted(candidate_pairs):
+            for k in (i, j):
+                if k not in token_sets:
+                    token_sets[k] = frozenset(self._word_re.findall(lowered[k]))
+            # Check if they're talking about the same thing (at least 2 common words)
+            if len(token_sets[i] & token_sets[j]) >= 2:
+                conflicts.append(f"Contradictory constraints: {constraints[i]} vs {constraints[j]}")
+        
+        # Check for conflicting facts; only facts whose keys share at least two
+        # words can conflict, so index keys by word and compare just those pairs
+        # Keys and values are lowercased once per fact rather than once per pair.
+        # Facts arrive as raw JSON from the memory endpoint, so values (and keys)
+        # may be numbers or booleans; compare their string forms
+        fact_items = list(facts.items())
+        key_words = [set(str(key).lower().split()) for key, _ in fact_items]
+        values_lower = [str(value).lower() for _, value in fact_items]
+        value_masks = [self._value_masks(v) for v in values_lower]
+        facts_by_word: Dict[str, List[int]] = {}
+        for i, words in enumerate(key_words):
+            for word in words:
+                facts_by_word.setdefault(word, []).append(i)
+
+        for i, (key, value) in enumerate(fact_items):
+            shared_words: Dict[int, int] = {}
+            for word in key_words[i]:
+                for j in facts_by_word[word]:
+                    shared_words[j] = shared_words.get(j, 0) + 1
+            for j in sorted(j for j, shared in shared_words.items() if shared >= 2 and j != i):
+                if values_lower[i] != values_lower[j] and self._masks_conflict(value_masks[i], value_masks[j]):
+                    other_key, other_value = fact_items[j]
                     conflicts.append(f"Conflicting facts: {key}={value} vs {other_key}={other_value}")
         
         return conflicts
     
-    def _are_contradictory(self, statement1: str, statement2: str) -> bool:
-        """Simple heuristic to detect contradictory statements"""
-        # Look for opposing keywords
-        opposing_pairs = [
-            ('must', 'must not'),
-            ('should', 'should not'),
-            ('always', 'never'),
-            ('required', 'forbidden'),
-            ('use', 'avoid'),
-            ('include', 'exclude')
-        ]
-        
-        s1_lower = statement1.lower()
-        s2_lower = statement2.lower()
-        
-        for pos, neg in opposing_pairs:
-            if pos in s1_lower and neg in s2_lower:
-                # Check if they're talking about the same thing
-                s1_words = set(re.findall(r'\b\w{4,}\b', s1_lower))
-                s2_words = set(re.findall(r'\b\w{4,}\b', s2_lower))
-                overlap = len(s1_words.intersection(s2_words))
-                if overlap >= 2:  # At least 2 common words
-                    return True
-        
-        return False
+    def _opposing_masks(self, text_lower: str) -> Tuple[int, int]:
+        """Bitmasks of which OPPOSING_PAIRS positive / negative keywords occur in the text"""
+        contains = self._keyword_lookup(text_lower)
+        pos_mask = neg_mask = 0
+        for bit, (pos, neg) in zip(self._OPPOSING_BITS, self.OPPOSING_PAIRS):
+            if contains(pos):
+                pos_mask |= bit
+            if contains(neg):
+                neg_mask |= bit
+        return pos_mask, neg_mask
     
-    def _facts_conflict(self, key1: str, value1: str, key2: str, value2: str) -> bool:
-        """Detect conflicting facts"""
-        # If keys are similar, values should be compatible
-        key_similarity = len(set(key1.lower().split()).intersection(set(key2.lower().split())))
-        
-        if key_similarity >= 2:  # Similar keys
-            # Check if values are contradictory
-            if value1.lower() != value2.lower():
-                # Simple contradiction detection
-                contradictory_words = [
-                    ('yes', 'no'), ('true', 'false'), ('enabled', 'disabled'),
-                    ('on', 'off'), ('allow', 'deny'), ('accept', 'reject')
-                ]
-                
-                v1_lower = value1.lower()
-                v2_lower = value2.lower()
-                
-                for word1, word2 in contradictory_words:
-                    if word1 in v1_lower and word2 in v2_lower:
-                        return True
-                    if word2 in v1_lower and word1 in v2_lower:
-                        return True
-        
-        return False
+    def _value_masks(self, value_lower: str) -> Tuple[int, int]:
+        """Bitmasks of which CONTRADICTORY_VALUES first / second words occur in the value"""
+        contains = self._keyword_lookup(value_lower)
+        first_mask = second_mask = 0
+        for bit, (word1, word2) in zip(self._CONTRADICTORY_BITS, self.CONTRADICTORY_VALUES):
+            if contains(word1):
+                first_mask |= bit
+            if contains(word2):
+                second_mask |= bit
+        return first_mask, second_mask
+
+    @staticmethod
+    def _masks_conflict(masks1: Tuple[int, int], masks2: Tuple[int, int]) -> bool:
+        # Either value has one side of a pair while the other value has the opposite side
+        return bool(masks1[0] & masks2[1] or masks1[1] & masks2[0])
     
     def generate_hygiene_report(self, 
-                              messages: List[Dict[str, Any]], 
-                              context_chunks: List[Dict[str, Any]],
-                              session_memory: Dict[str, Any]) -> Dict[str, Any]:
-        """Generate comprehensive hygiene report"""
-        report = {
-            'timestamp': datetime.now().isoformat(),
+                              messages: Iterable[Dict[str, Any]], 
+                              context_chunks: Iterable[Dict[str, Any]],
+                              session_memory: Dict[str, Any],
+                              timestamp: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Generate comprehensive hygiene report. Messages and chunks are consumed in a
+        single pass, so callers can pass generators instead of building lists. Callers
+        producing many reports at once can pass a precomputed ISO timestamp instead of
+        reading the clock per report.
+        """
+        report: Dict[str, Any] = {
+            'timestamp': timestamp or datetime.now().isoformat(),
             'message_analysis': {
-                'total_messages': len(messages),
+                'total_messages': 0,
                 'issues_found': 0,
                 'warnings': 0,
                 'sanitized_messages': 0
             },
             'context_analysis': {
-                'total_chunks': len(context_chunks),
+                'total_chunks': 0,
                 'chunk_size_distribution': {},
                 'quality_score': 0
             },
@@ -329,27 +497,45 @@ class ContextHygiene:
         }
         
         # Analyze messages
+        message_count = issues_found = warning_count = sanitized_messages = 0
+        validate = self._validate_cached  # same as validate_message, minus a call layer
         for msg in messages:
-            validation = self.validate_message(msg.get('content', ''), msg.get('role', ''))
-            if validation.issues:
-                report['message_analysis']['issues_found'] += len(validation.issues)
-            if validation.warnings:
-                report['message_analysis']['warnings'] += len(validation.warnings)
+            message_count += 1
+            validation = validate(msg.get('content', ''), msg.get('role', ''))
+            issues_found += len(validation.issues)
+            warning_count += len(validation.warnings)
             if validation.sanitized_content:
-                report['message_analysis']['sanitized_messages'] += 1
-        
-        # Analyze context chunks
-        chunk_sizes = [len(chunk.get('content', '')) for chunk in context_chunks]
-        if chunk_sizes:
+                sanitized_messages += 1
+        message_analysis = report['message_analysis']
+        message_analysis['total_messages'] = message_count
+        message_analysis['issues_found'] = issues_found
+        message_analysis['warnings'] = warning_count
+        message_analysis['sanitized_messages'] = sanitized_messages
+        
+        # Analyze context chunks in one pass: count, min, max, sum and sum of squares
+        count = total = total_sq = 0
+        smallest = largest = None
+        for chunk in context_chunks:
+            size = len(chunk.get('content', ''))
+            count += 1
+            total += size
+            total_sq += size * size
+            if smallest is None or size < smallest:
+                smallest = size
+            if largest is None or size > largest:
+                largest = size
+        report['context_analysis']['total_chunks'] = count
+        if count:
             report['context_analysis']['chunk_size_distribution'] = {
-                'min': min(chunk_sizes),
-                'max': max(chunk_sizes),
-                'avg': sum(chunk_sizes) / len(chunk_sizes)
+                'min': smallest,
+                'max': largest,
+                'avg': total / count
             }
             
             # Quality score based on chunk size distribution
             optimal_size = 200  # Optimal chunk size
-            size_variance = sum((size - optimal_size) ** 2 for size in chunk_sizes) / len(chunk_sizes)
+            # Mean squared distance from the optimal size, expanded so it only needs the sums
+            size_variance = (total_sq - 2 * optimal_size * total + count * optimal_size ** 2) / count
             report['context_analysis']['quality_score'] = max(0, 100 - (size_variance / 100))
         
         # Analyze memory conflicts
@@ -366,7 +552,7 @@ class ContextHygiene:
         if len(conflicts) > 0:
             report['recommendations'].append("Resolve memory conflicts")
         
-        if report['message_analysis']['sanitized_messages'] / max(1, len(messages)) > 0.1:
+        if sanitized_messages / max(1, message_count) > 0.1:
             report['recommendations'].append("High sanitization rate - review content policies")
         
         return report
@@ -3,43 +3,150 @@ Enhanced Context Management System
 Implements comprehensive context management patterns for LLM conversations
 """
 
-import json
 import hashlib
+import heapq
+import math
 import time
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, FrozenSet, Deque
 from dataclasses import dataclass, asdict
+from functools import cached_property, lru_cache
 from datetime import datetime, timedelta
 import re
 import logging
+import orjson
+from collections import Counter, defaultdict, deque
+from itertools import count
+
+try:
+    # Optional: xxhash is a much cheaper non-cryptographic hash for content keys
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    # Optional: tiktoken gives BPE token counts instead of the 4-characters-per-token estimate
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 logger = logging.getLogger(__name__)
 
+_WORD_RE = re.compile(r'\w+')
+
+# Okapi BM25 parameters for chunk retrieval
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Constraints/decisions kept in session memory
+MAX_CONSTRAINTS_DECISIONS = 10
+
+# Context chunks kept for retrieval; the oldest are dropped first
+MAX_CONTEXT_CHUNKS = 20
+
+# Retrieval boost for the more important chunk types
+_TYPE_BOOST = {
+    'decision': 1.5,
+    'constraint': 1.4,
+    'fact': 1.3,
+    'exchange': 1.0
+}
+
+# Chunk classification phrases, in priority order
+_CHUNK_TYPE_PHRASES = (
+    ('decision', ('decision:', 'decided', 'let\'s use', 'we\'ll go with', 'agreed')),
+    ('constraint', ('constraint:', 'must', 'should not', 'requirement', 'rule')),
+    ('fact', ('fact:', 'is defined as', 'equals', 'specification')),
+)
+
+# Common words skipped by topic extraction
+_STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by',
+    'is', 'are', 'was', 'were', 'be', 'been', 'have', 'has', 'had', 'do', 'does', 'did',
+    'will', 'would', 'should', 'could', 'can', 'may', 'might', 'must',
+    'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them',
+    'my', 'your', 'his', 'its', 'our', 'their'
+})
+
+
+TOKEN_ENCODING = "cl100k_base"
+_encoding = None
+
+
+def load_token_encoding() -> bool:
+    """
+    Load the tiktoken encoding so count_tokens switches to BPE counts. Blocking (the
+    encoding file is downloaded on first use), so the app runs it in a worker thread
+    at startup; until it finishes, count_tokens uses the character estimate.
+    """
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            # Offline installs can't download the encoding file
+            logger.warning("tiktoken encoding %s unavailable, estimating tokens: %s", TOKEN_ENCODING, e)
+    return _encoding is not None
+
+
+@lru_cache(maxsize=4096)
+def _bpe_token_count(text: str) -> int:
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def count_tokens(text: str) -> int:
+    """Token count of text: BPE tokens once the encoding is loaded, else roughly 1 token per 4 characters"""
+    if _encoding is None:
+        return len(text) // 4
+    return _bpe_token_count(text)
+
+
+def _content_hash(data: bytes) -> str:
+    """32-hex-char content key hash (not for security)"""
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
 @dataclass
 class Message:
     role: str
     content: str
     timestamp: float = None
-    message_id: str = None
+    message_id: int = None  # assigned per session by ContextManager
     tokens: int = 0
     salience_score: float = 1.0
     
     def __post_init__(self):
         if self.timestamp is None:
             self.timestamp = time.time()
-        if self.message_id is None:
-            self.message_id = hashlib.md5(f"{self.role}:{self.content}:{self.timestamp}".encode()).hexdigest()[:8]
         if self.tokens == 0:
             self.tokens = self.estimate_tokens()
     
     def estimate_tokens(self) -> int:
-        """Rough token estimation: 1 token ≈ 4 characters"""
-        return max(1, len(self.content) // 4)
+        """Token estimation via count_tokens (tiktoken, or 1 token ≈ 4 characters)"""
+        return max(1, count_tokens(self.content))
+    
+    @cached_property
+    def word_set(self) -> FrozenSet[str]:
+        """Lowercased words of the content, tokenized once on first use"""
+        return frozenset(_WORD_RE.findall(self.content.lower()))
+    
+    @cached_property
+    def record(self) -> Dict[str, Any]:
+        """API dict of the message, built once and shared by the history and hygiene endpoints"""
+        return {
+            'id': self.message_id,
+            'role': self.role,
+            'content': self.content,
+            'timestamp': self.timestamp,
+            'tokens': self.tokens
+        }
 
 @dataclass
 class ContextChunk:
     """A chunk of conversation context for RAG retrieval"""
     content: str
-    message_ids: List[str]
+    message_ids: List[int]
     chunk_type: str  # 'decision', 'constraint', 'fact', 'exchange'
     timestamp: float
     tokens: int
@@ -47,7 +154,23 @@ class ContextChunk:
     
     def __post_init__(self):
         if self.embedding_key is None:
-            self.embedding_key = hashlib.md5(self.content.encode()).hexdigest()
+            self.embedding_key = _content_hash(self.content.encode())
+    
+    @cached_property
+    def term_counts(self) -> Counter:
+        """Lowercased word frequencies of the content, tokenized once for indexing"""
+        return Counter(_WORD_RE.findall(self.content.lower()))
+    
+    @cached_property
+    def record(self) -> Dict[str, Any]:
+        """API dict of the chunk, built once and shared by the search and hygiene endpoints"""
+        return {
+            'content': self.content,
+            'chunk_type': self.chunk_type,
+            'timestamp': self.timestamp,
+            'tokens': self.tokens,
+            'message_ids': self.message_ids
+        }
 
 @dataclass
 class SessionMemory:
@@ -78,6 +201,15 @@ class SessionMemory:
             self.canonical_facts = {}
         if self.entities is None:
             self.entities = {}
+    
+    def add_constraint_decision(self, item: str) -> bool:
+        """Record a constraint or decision, skipping duplicates and keeping the latest 10"""
+        if item in self.constraints_decisions:
+            return False
+        self.constraints_decisions.append(item)
+        if len(self.constraints_decisions) > MAX_CONSTRAINTS_DECISIONS:
+            del self.constraints_decisions[0]
+        return True
 
 class ContextManager:
     """
@@ -100,74 +232,136 @@ class ContextManager:
         
         # Conversation storage
         self.messages: List[Message] = []
-        self.context_chunks: List[ContextChunk] = []
+        self._recent_tokens = 0  # tokens in the recent window, kept up to date on add/trim
+        self.context_chunks: Deque[ContextChunk] = deque(maxlen=MAX_CONTEXT_CHUNKS)
         self.session_memory = SessionMemory()
+        self._message_ids = count(1)
+        
+        # BM25 index over context_chunks: word -> (idf, [(position, term frequency)]),
+        # plus each chunk's length normalization and type boost; rebuilt lazily after
+        # chunks change
+        self._chunk_index: Optional[Dict[str, Tuple[float, List[Tuple[int, int]]]]] = None
+        self._chunk_norms: List[float] = []
+        self._chunk_boosts: List[float] = []
         
         # Context management state
         self.last_condensation = 0
         self.condensation_count = 0
+        self.condensing = False
         
+        # Bumped on every change to the conversation state, so callers can cache
+        # anything derived from it
+        self.revision = 0
+    
+    def reset(self):
+        """Clear all conversation state, keeping the limits, so the instance can be reused"""
+        self.messages.clear()
+        self._recent_tokens = 0
+        self.context_chunks.clear()
+        self.session_memory = SessionMemory()
+        self._message_ids = count(1)
+        self._chunk_index = None
+        self._chunk_norms = []
+        self._chunk_boosts = []
+        self.last_condensation = 0
+        self.condensation_count = 0
+        self.condensing = False
+        self.revision += 1
+        
+    def __getstate__(self) -> Dict[str, Any]:
+        """Pickle state for offloading idle sessions; the BM25 index is rebuilt lazily"""
+        state = self.__dict__.copy()
+        # Store the next message ID as a plain int rather than pickling the counter
+        next_id = next(self._message_ids)
+        self._message_ids = count(next_id)
+        state['_message_ids'] = next_id
+        state['_chunk_index'] = None
+        state['condensing'] = False
+        return state
+    
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._message_ids = count(state['_message_ids'])
+    
     def add_message(self, role: str, content: str, salience_score: float = 1.0) -> Message:
         """Add a new message to the conversation"""
-        message = Message(role=role, content=content, salience_score=salience_score)
+        message = Message(role=role, content=content, salience_score=salience_score,
+                          message_id=next(self._message_ids))
         self.messages.append(message)
+        self.revision += 1
         
-        # Update salience scores based on recency and interaction patterns
-        self._update_salience_scores()
-        
+        # Slide the recent window's token total instead of re-summing it
+        self._recent_tokens += message.tokens
+        if self.recent_window_size and len(self.messages) > self.recent_window_size:
+            self._recent_tokens -= self.messages[-self.recent_window_size - 1].tokens
         return message
     
-    def _update_salience_scores(self):
-        """Update salience scores using time decay and interaction patterns"""
+    def add_messages(self, items: List[Tuple[str, str, float]]) -> List[Message]:
+        """Add a batch of (role, content, salience_score) messages, e.g. an imported history"""
+        messages = [
+            Message(role=role, content=content, salience_score=salience_score,
+                    message_id=next(self._message_ids))
+            for role, content, salience_score in items
+        ]
+        self.messages.extend(messages)
+        self._recent_tokens = self._sum_recent_tokens()
+        self.revision += 1
+        return messages
+    
+    def _sum_recent_tokens(self) -> int:
+        """Recount the tokens of the messages in the recent window"""
+        return sum(msg.tokens for msg in self.messages[-self.recent_window_size:])
+    
+    def salience_scores(self, limit: Optional[int] = None) -> List[float]:
+        """
+        Effective salience of each message, computed on read from its base score
+        with time decay and position bias, so adding a message doesn't rescan history.
+        With a limit, only the most recent `limit` messages are scored.
+        """
         current_time = time.time()
-        for i, msg in enumerate(self.messages):
-            # Time decay factor
-            age_hours = (current_time - msg.timestamp) / 3600
-            time_decay = max(0.1, 1.0 - (age_hours / 24))  # Decay over 24 hours
-            
-            # Position bias (recent messages more salient)
-            position_bias = (i + 1) / len(self.messages)
-            
-            # Update salience score
-            msg.salience_score = min(2.0, msg.salience_score * time_decay * position_bias)
+        total = len(self.messages)
+        messages = self.messages[-limit:] if limit else self.messages
+        return [
+            # Time decay over 24 hours; position bias makes recent messages more salient
+            min(2.0, msg.salience_score
+                * max(0.1, 1.0 - (current_time - msg.timestamp) / 3600 / 24)
+                * (position / total))
+            for position, msg in enumerate(messages, total - len(messages) + 1)
+        ]
     
     def estimate_context_tokens(self, include_memory: bool = True) -> Dict[str, int]:
         """Calculate token usage across different context components"""
-        breakdown = {
-            'system': 0,
-            'constraints_decisions': 0,
-            'rolling_summary': 0,
-            'recent_messages': 0,
-            'retrieved_chunks': 0,
-            'scratchpad': 0,
-            'total': 0
-        }
-        
+        constraints_tokens = rolling_summary_tokens = scratchpad_tokens = 0
         if include_memory:
+            memory = self.session_memory
             # System prompt and constraints
-            constraints_text = "\n".join(self.session_memory.constraints_decisions)
-            breakdown['constraints_decisions'] = len(constraints_text) // 4
+            constraints_tokens = count_tokens("\n".join(memory.constraints_decisions))
             
             # Rolling summary
-            breakdown['rolling_summary'] = len(self.session_memory.rolling_summary) // 4
+            rolling_summary_tokens = count_tokens(memory.rolling_summary)
             
             # Scratchpad
-            scratchpad_text = f"{self.session_memory.current_topic} {self.session_memory.working_context}"
-            breakdown['scratchpad'] = len(scratchpad_text) // 4
+            scratchpad_tokens = count_tokens(f"{memory.current_topic} {memory.working_context}")
         
         # Recent messages
-        recent_messages = self.messages[-self.recent_window_size:]
-        breakdown['recent_messages'] = sum(msg.tokens for msg in recent_messages)
-        
-        # Calculate total
-        breakdown['total'] = sum(breakdown.values())
+        recent_tokens = self._recent_tokens
         
-        return breakdown
+        return {
+            'system': 0,
+            'constraints_decisions': constraints_tokens,
+            'rolling_summary': rolling_summary_tokens,
+            'recent_messages': recent_tokens,
+            'retrieved_chunks': 0,
+            'scratchpad': scratchpad_tokens,
+            'total': constraints_tokens + rolling_summary_tokens + recent_tokens + scratchpad_tokens
+        }
     
     def needs_condensation(self) -> bool:
         """Determine if context needs condensation"""
-        token_breakdown = self.estimate_context_tokens()
-        
+        return self._needs_condensation(self.estimate_context_tokens())
+    
+    def _needs_condensation(self, token_breakdown: Dict[str, int]) -> bool:
+        """Condensation check against an already computed token breakdown"""
         # Check if we're approaching token limit
         usage_ratio = token_breakdown['total'] / self.available_tokens
         
@@ -184,7 +378,8 @@ class ContextManager:
         i = 0
         while i < len(messages):
             chunk_messages = [messages[i]]
-            chunk_content = f"{messages[i].role}: {messages[i].content}"
+            parts = [f"{messages[i].role}: {messages[i].content}"]
+            content_length = len(parts[0])
             
             # Look ahead for related messages (same topic/entity continuation)
             j = i + 1
@@ -193,13 +388,16 @@ class ContextManager:
                 
                 # Check if messages are related (simple heuristic)
                 if (self._messages_related(messages[i], next_msg) and 
-                    len(chunk_content) < 400):  # Keep chunks manageable
+                    content_length < 400):  # Keep chunks manageable
                     chunk_messages.append(next_msg)
-                    chunk_content += f"\n{next_msg.role}: {next_msg.content}"
+                    parts.append(f"{next_msg.role}: {next_msg.content}")
+                    content_length += 1 + len(parts[-1])
                     j += 1
                 else:
                     break
             
+            chunk_content = "\n".join(parts)
+            
             # Determine chunk type
             chunk_type = self._classify_chunk_type(chunk_content)
             
@@ -228,34 +426,24 @@ class ContextManager:
             return False
         
         # Content similarity (shared entities/keywords)
-        words1 = set(re.findall(r'\w+', msg1.content.lower()))
-        words2 = set(re.findall(r'\w+', msg2.content.lower()))
-        overlap = len(words1.intersection(words2))
-        min_length = min(len(words1), len(words2))
+        words1 = msg1.word_set
+        words2 = msg2.word_set
+        if words1.isdisjoint(words2):
+            return False
         
-        return overlap / max(min_length, 1) > 0.2
+        # More than 20% of the shorter message's words are shared
+        overlap = len(words1 & words2)
+        return 5 * overlap > min(len(words1), len(words2))
     
     def _classify_chunk_type(self, content: str) -> str:
         """Classify chunk type for better organization"""
         content_lower = content.lower()
         
-        # Decision patterns
-        if any(phrase in content_lower for phrase in [
-            'decision:', 'decided', 'let\'s use', 'we\'ll go with', 'agreed'
-        ]):
-            return 'decision'
-        
-        # Constraint patterns
-        if any(phrase in content_lower for phrase in [
-            'constraint:', 'must', 'should not', 'requirement', 'rule'
-        ]):
-            return 'constraint'
-        
-        # Fact patterns
-        if any(phrase in content_lower for phrase in [
-            'fact:', 'is defined as', 'equals', 'specification'
-        ]):
-            return 'fact'
+        # Decision, then constraint, then fact patterns
+        for chunk_type, phrases in _CHUNK_TYPE_PHRASES:
+            for phrase in phrases:
+                if phrase in content_lower:
+                    return chunk_type
         
         return 'exchange'
     
@@ -264,38 +452,59 @@ class ContextManager:
         if not self.context_chunks:
             return []
         
-        # Simple keyword-based similarity (in production, use vector embeddings)
-        query_words = set(re.findall(r'\w+', query.lower()))
+        # Keyword-based relevance (in production, use vector embeddings)
+        query_words = set(_WORD_RE.findall(query.lower()))
+        
+        # BM25 over the inverted index: only chunks sharing a word with the query score
+        if self._chunk_index is None:
+            self._build_chunk_index()
+        relevance = defaultdict(float)
+        for word in query_words:
+            entry = self._chunk_index.get(word)
+            if entry is None:
+                continue
+            idf, postings = entry
+            for position, freq in postings:
+                relevance[position] += idf * freq * (BM25_K1 + 1) / (freq + self._chunk_norms[position])
         
+        current_time = time.time()
         scored_chunks = []
-        for chunk in self.context_chunks:
-            chunk_words = set(re.findall(r'\w+', chunk.content.lower()))
-            
-            # Calculate similarity score
-            overlap = len(query_words.intersection(chunk_words))
-            union = len(query_words.union(chunk_words))
-            jaccard_similarity = overlap / max(union, 1)
+        for position in sorted(relevance):
+            chunk = self.context_chunks[position]
             
-            # Boost important chunk types
-            type_boost = {
-                'decision': 1.5,
-                'constraint': 1.4,
-                'fact': 1.3,
-                'exchange': 1.0
-            }.get(chunk.chunk_type, 1.0)
+            # Time decay over 48 hours (prefer newer chunks slightly)
+            time_factor = max(0.5, 1.0 - (current_time - chunk.timestamp) / 3600 / 48)
             
-            # Time decay (prefer newer chunks slightly)
-            age_hours = (time.time() - chunk.timestamp) / 3600
-            time_factor = max(0.5, 1.0 - (age_hours / 48))  # Decay over 48 hours
-            
-            final_score = jaccard_similarity * type_boost * time_factor
+            final_score = relevance[position] * self._chunk_boosts[position] * time_factor
             
             if final_score > 0.1:  # Minimum relevance threshold
                 scored_chunks.append((chunk, final_score))
         
-        # Sort by score and return top chunks
-        scored_chunks.sort(key=lambda x: x[1], reverse=True)
-        return [chunk for chunk, score in scored_chunks[:max_chunks]]
+        # Partial top-k selection instead of sorting every scored chunk
+        return [chunk for chunk, score in heapq.nlargest(max_chunks, scored_chunks, key=lambda x: x[1])]
+    
+    def _build_chunk_index(self):
+        """Build the BM25 inverted index and per-chunk scoring factors for context_chunks"""
+        postings = defaultdict(list)
+        lengths = []
+        boosts = []
+        for position, chunk in enumerate(self.context_chunks):
+            counts = chunk.term_counts
+            for word, freq in counts.items():
+                postings[word].append((position, freq))
+            lengths.append(sum(counts.values()))
+            boosts.append(_TYPE_BOOST.get(chunk.chunk_type, 1.0))
+        
+        chunk_count = len(lengths)
+        avg_length = sum(lengths) / max(chunk_count, 1) or 1.0
+        self._chunk_norms = [
+            BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length) for length in lengths
+        ]
+        self._chunk_boosts = boosts
+        self._chunk_index = {
+            word: (math.log(1 + (chunk_count - len(hits) + 0.5) / (len(hits) + 0.5)), hits)
+            for word, hits in postings.items()
+        }
     
     async def condense_context(self, llm_function) -> Dict[str, Any]:
         """
@@ -306,37 +515,39 @@ class ContextManager:
         
         original_tokens = self.estimate_context_tokens()['total']
         
-        # Strategy 1: Create/update rolling summary
-        messages_to_summarize = self.messages[:-self.recent_window_size]
-        if messages_to_summarize:
-            new_summary = await self._create_rolling_summary(messages_to_summarize, llm_function)
-            self.session_memory.rolling_summary = new_summary
-            self.session_memory.summary_version += 1
-        
-        # Strategy 2: Extract constraints and decisions
-        await self._extract_constraints_decisions(messages_to_summarize, llm_function)
+        # Flag the LLM round trips so the session isn't pooled while they are pending;
+        # cleared even if a call fails or the request is cancelled
+        self.condensing = True
+        try:
+            # Strategy 1: Create/update rolling summary
+            messages_to_summarize = self.messages[:-self.recent_window_size]
+            if messages_to_summarize:
+                new_summary = await self._create_rolling_summary(messages_to_summarize, llm_function)
+                self.session_memory.rolling_summary = new_summary
+                self.session_memory.summary_version += 1
+            
+            # Strategy 2: Extract constraints and decisions
+            await self._extract_constraints_decisions(messages_to_summarize, llm_function)
+        finally:
+            self.condensing = False
         
-        # Strategy 3: Create context chunks for RAG
+        # Strategy 3: Create context chunks for RAG. Chunks are created in time order,
+        # so the bounded deque drops the oldest ones (keep only last 20)
         new_chunks = self.create_context_chunks(messages_to_summarize)
         self.context_chunks.extend(new_chunks)
+        self._chunk_index = None
         
         # Strategy 4: Trim to recent messages only
         kept_messages = self.messages[-self.recent_window_size:]
         self.messages = kept_messages
-        
-        # Strategy 5: Clean up old chunks (keep only last 20)
-        if len(self.context_chunks) > 20:
-            self.context_chunks = sorted(
-                self.context_chunks, 
-                key=lambda x: x.timestamp, 
-                reverse=True
-            )[:20]
+        self._recent_tokens = self._sum_recent_tokens()
         
         new_tokens = self.estimate_context_tokens()['total']
         token_savings = original_tokens - new_tokens
         
         self.last_condensation = time.time()
         self.condensation_count += 1
+        self.revision += 1
         
         return {
             'action': 'condensed',
@@ -353,14 +564,12 @@ class ContextManager:
         if not messages:
             return self.session_memory.rolling_summary
         
-        # Convert messages to conversation text
-        conversation_text = ""
-        for msg in messages:
-            role_label = "User" if msg.role == "user" else "Assistant"
-            conversation_text += f"{role_label}: {msg.content}\n\n"
+        # Send the turns as chat history with the instruction appended last, so
+        # both condensation calls share one prefix Ollama can keep in its KV cache
+        history = self._chat_history(messages)
         
         # Create enhanced summarization prompt
-        summary_prompt = f"""Update this conversation summary with new information. Focus on:
+        summary_prompt = f"""Update this conversation summary with the new information from the conversation above. Focus on:
 1. Key decisions made ([Decision]: format)
 2. Important constraints ([Constraint]: format) 
 3. Factual discoveries ([Fact]: format)
@@ -368,69 +577,60 @@ class ContextManager:
 
 Previous summary: {self.session_memory.rolling_summary or 'None'}
 
-New conversation:
-{conversation_text}
-
 Updated summary (max 100 words, use tags):"""
 
         try:
-            response = await llm_function(summary_prompt)
+            response = await llm_function(summary_prompt, history)
             return response.strip()
         except Exception as e:
-            logger.error(f"Summary creation failed: {e}")
+            logger.error("Summary creation failed: %s", e)
             # Fallback: simple concatenation
+            conversation_text = " ".join(msg.content for msg in messages)
             fallback_summary = f"Recent conversation about {self._extract_topic(conversation_text)}"
             return fallback_summary if len(fallback_summary) < 200 else fallback_summary[:200]
     
+    @staticmethod
+    def _chat_history(messages: List[Message]) -> List[Dict[str, str]]:
+        """Chat-format turns to prepend to a condensation instruction"""
+        return [{'role': msg.role, 'content': msg.content} for msg in messages]
+    
     async def _extract_constraints_decisions(self, messages: List[Message], llm_function):
         """Extract and formalize constraints and decisions"""
         if not messages:
             return
         
-        conversation_text = ""
-        for msg in messages[-5:]:  # Focus on recent messages for extraction
-            conversation_text += f"{msg.role}: {msg.content}\n"
-        
-        extraction_prompt = f"""Extract any explicit decisions or constraints from this conversation. Return as JSON:
-
-{conversation_text}
+        # Same history prefix as the summary call, so only this instruction is new
+        extraction_prompt = """Extract any explicit decisions or constraints from the conversation above, focusing on the most recent turns. Return as JSON:
 
 Format:
-{{"decisions": ["Decision: Use X for Y"], "constraints": ["Constraint: Must avoid Z"]}}
+{"decisions": ["Decision: Use X for Y"], "constraints": ["Constraint: Must avoid Z"]}
 
 JSON:"""
 
         try:
-            response = await llm_function(extraction_prompt)
-            # Simple JSON parsing attempt
-            if '{' in response and '}' in response:
-                json_str = response[response.find('{'):response.rfind('}')+1]
-                extracted = json.loads(json_str)
-                
-                if 'decisions' in extracted:
-                    self.session_memory.constraints_decisions.extend(extracted['decisions'])
-                if 'constraints' in extracted:
-                    self.session_memory.constraints_decisions.extend(extracted['constraints'])
+            response = await llm_function(extraction_prompt, self._chat_history(messages))
+            # Simple JSON parsing attempt on the outermost {...} span
+            start, end = response.find('{'), response.rfind('}')
+            if start != -1 and end > start:
+                extracted = orjson.loads(response[start:end + 1])
                 
-                # Keep only unique items and limit to 10
-                self.session_memory.constraints_decisions = list(set(
-                    self.session_memory.constraints_decisions
-                ))[-10:]
+                # Keep unique items in insertion order, limited to the latest 10
+                for key in ('decisions', 'constraints'):
+                    for item in extracted.get(key) or ():
+                        if isinstance(item, str):
+                            self.session_memory.add_constraint_decision(item)
                 
         except Exception as e:
-            logger.error(f"Constraint extraction failed: {e}")
+            logger.error("Constraint extraction failed: %s", e)
     
     def _extract_topic(self, text: str) -> str:
         """Extract the main topic from conversation text"""
         # Simple topic extraction using common words
-        words = re.findall(r'\w+', text.lower())
+        words = _WORD_RE.findall(text.lower())
         word_freq = {}
         
-        # Skip common words
-        stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'should', 'could', 'can', 'may', 'might', 'must', 'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her', 'us', 'them', 'my', 'your', 'his', 'her', 'its', 'our', 'their'}
-        
         for word in words:
-            if len(word) > 3 and word not in stop_words:
+            if len(word) > 3 and word not in _STOP_WORDS:
                 word_freq[word] = word_freq.get(word, 0) + 1
         
         if word_freq:
@@ -474,12 +674,10 @@ JSON:"""
                 })
         
         # 4. Recent conversation turns
-        recent_messages = self.messages[-self.recent_window_size:]
-        for msg in recent_messages:
-            context_messages.append({
-                "role": msg.role,
-                "content": msg.content
-            })
+        context_messages.extend(
+            {"role": msg.role, "content": msg.content}
+            for msg in self.messages[-self.recent_window_size:]
+        )
         
         return context_messages
     
@@ -494,7 +692,7 @@ JSON:"""
             'usage_percentage': (token_breakdown['total'] / self.available_tokens) * 100,
             'condensation_count': self.condensation_count,
             'last_condensation': self.last_condensation,
-            'needs_condensation': self.needs_condensation(),
+            'needs_condensation': self._needs_condensation(token_breakdown),
             'constraints_decisions': len(self.session_memory.constraints_decisions),
             'has_summary': bool(self.session_memory.rolling_summary),
             'summary_version': self.session_memory.summary_version,
@@ -3,68 +3,258 @@ Context Service for Enhanced Context Management
 Provides API endpoints for context management operations
 """
 
-import json
+import asyncio
 import httpx
+import orjson
 import os
-from typing import List, Dict, Any, Optional
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from collections import deque
+from cachetools import LRUCache
 from fastapi import HTTPException
-from context_manager import ContextManager, Message
+from context_manager import ContextManager, Message, count_tokens
 from context_hygiene import context_hygiene
+from llm_cache import SingleFlight
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Context operations (summaries, extraction) are short non-streaming calls
+LLM_REQUEST_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+# Sessions kept in memory; least recently used ones beyond this are written to
+# SESSION_STORE_DIR (set it empty to drop them instead) and reloaded on demand
+MAX_ACTIVE_SESSIONS = int(os.getenv("MAX_ACTIVE_SESSIONS", "256"))
+SESSION_STORE_DIR = os.getenv(
+    "SESSION_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions")
+)
+
+# Cleared ContextManagers kept around for reuse by new sessions
+CONTEXT_MANAGER_POOL_SIZE = 32
+
+class ContextManagerPool:
+    """Pool of reset ContextManagers so session churn reuses instances"""
+    
+    def __init__(self, factory: Callable[[], ContextManager], maxsize: int = CONTEXT_MANAGER_POOL_SIZE):
+        self._factory = factory
+        self._free = deque(maxlen=maxsize)
+    
+    def acquire(self) -> ContextManager:
+        """Return a cleared ContextManager, reusing a released one if available"""
+        if self._free:
+            return self._free.pop()
+        return self._factory()
+    
+    def release(self, context_manager: ContextManager):
+        """Reset a ContextManager that is no longer used and keep it for reuse"""
+        # A pending condensation would write into whichever session reuses it
+        if context_manager.condensing:
+            return
+        context_manager.reset()
+        self._free.append(context_manager)
+
+class SessionCache(LRUCache):
+    """LRU cache of active sessions that hands each evicted session to a callback"""
+    
+    def __init__(self, maxsize: int, on_evict: Callable[[str, ContextManager], None]):
+        super().__init__(maxsize=maxsize)
+        self._on_evict = on_evict
+    
+    def popitem(self):
+        session_id, context_manager = super().popitem()
+        self._on_evict(session_id, context_manager)
+        return session_id, context_manager
+
 class ContextService:
     """Service layer for context management operations"""
     
     def __init__(self, ollama_url: str):
         self.ollama_url = ollama_url
-        self.sessions: Dict[str, ContextManager] = {}  # session_id -> ContextManager
+        # Long-lived pooled client so each LLM call reuses an open Ollama connection
+        self.client = httpx.AsyncClient(
+            timeout=LLM_REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            http2=True,
+        )
+        # session_id -> ContextManager, bounded; evicted sessions are offloaded to disk
+        self.sessions = SessionCache(MAX_ACTIVE_SESSIONS, self._offload_session)
+        self.session_store_dir = SESSION_STORE_DIR
+        # Sessions evicted mid-condensation, offloaded once the condensation finishes
+        self._evicted_condensing: Dict[str, ContextManager] = {}
+        # Session file reads, writes and removals run in order on one thread, off the
+        # event loop, so a reload always sees the session's last queued write or removal
+        self._file_io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store")
+        # Concurrent lookups of the same offloaded session share one reload
+        self._session_loads = SingleFlight()
+        # session_id -> ((revision, query, include_stats), result) of the last built context
+        self._context_cache: Dict[str, Tuple[Tuple[int, str, bool], Dict[str, Any]]] = {}
         
         # Get configurable context limits from environment
         self.default_max_tokens = int(os.getenv("CONTEXT_MAX_TOKENS", "32000"))
         self.default_reply_reserve_ratio = float(os.getenv("CONTEXT_REPLY_RESERVE_RATIO", "0.25"))
         self.default_recent_window_size = int(os.getenv("CONTEXT_RECENT_WINDOW_SIZE", "8"))
+        
+        self._pool = ContextManagerPool(lambda: ContextManager(
+            max_tokens=self.default_max_tokens,
+            reply_reserve_ratio=self.default_reply_reserve_ratio,
+            recent_window_size=self.default_recent_window_size
+        ))
+    
+    async def get_or_create_session(self, session_id: str = "default") -> ContextManager:
+        """Get existing session, reload an offloaded one, or create a new one"""
+        context_manager = self.sessions.get(session_id)
+        # Checked again after each reload, since other requests run while it is awaited
+        # and could evict the session before this one gets to use it
+        while context_manager is None:
+            await self._session_loads.run(session_id, lambda: self._restore_session(session_id))
+            context_manager = self.sessions.get(session_id)
+        return context_manager
+    
+    async def _restore_session(self, session_id: str):
+        context_manager = self._evicted_condensing.pop(session_id, None)
+        if context_manager is None:
+            context_manager = await self._load_session(session_id)
+        if context_manager is None:
+            context_manager = self._pool.acquire()
+        self.sessions[session_id] = context_manager
+    
+    def _session_path(self, session_id: str) -> Optional[str]:
+        """File an offloaded session is stored in, or None when persistence is off"""
+        if not self.session_store_dir:
+            return None
+        return os.path.join(self.session_store_dir, f"{quote(session_id, safe='')}.pkl")
+    
+    def _offload_session(self, session_id: str, context_manager: ContextManager):
+        """Write a session evicted from the active set to disk, then pool the instance"""
+        self._context_cache.pop(session_id, None)
+        if context_manager.condensing:
+            # Pickling now would save the pre-condensation state and lose the result;
+            # _condense offloads the session once its condensation finishes
+            self._evicted_condensing[session_id] = context_manager
+            return
+        if self._session_path(session_id) is None:
+            self._pool.release(context_manager)
+            return
+        # Pickled on the I/O thread; nothing else holds the evicted instance, and it is
+        # only reset for reuse once that snapshot has been written
+        self._queue_file_op(session_id, context_manager, lambda: self._pool.release(context_manager))
+    
+    async def _load_session(self, session_id: str) -> Optional[ContextManager]:
+        """Reload an offloaded session, removing its file once it is active again"""
+        path = self._session_path(session_id)
+        if path is None:
+            return None
+        loop = asyncio.get_running_loop()
+        context_manager = await loop.run_in_executor(self._file_io, self._read_session_file, path)
+        if context_manager is not None:
+            self._queue_file_op(session_id, None)
+        return context_manager
+    
+    def _queue_file_op(self, session_id: str, context_manager: Optional[ContextManager],
+                       on_done: Optional[Callable[[], None]] = None):
+        """
+        Write a session's file, or remove it when context_manager is None, on the I/O
+        thread; on_done then runs back on the event loop
+        """
+        path = self._session_path(session_id)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (scripts, shutdown): nothing to block, so do it inline
+            self._write_session_file(path, context_manager)
+            if on_done is not None:
+                on_done()
+            return
+        future = loop.run_in_executor(self._file_io, self._write_session_file, path, context_manager)
+        if on_done is not None:
+            future.add_done_callback(lambda _: on_done())
+    
+    @staticmethod
+    def _read_session_file(path: str) -> Optional[ContextManager]:
+        try:
+            if not os.path.exists(path):
+                return None
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            logger.error("Failed to reload session from %s: %s", path, e)
+            return None
+    
+    @staticmethod
+    def _write_session_file(path: str, context_manager: Optional[ContextManager]):
+        try:
+            if context_manager is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                return
+            data = pickle.dumps(context_manager, protocol=pickle.HIGHEST_PROTOCOL)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error("Session store I/O failed for %s: %s", path, e)
     
-    def get_or_create_session(self, session_id: str = "default") -> ContextManager:
-        """Get existing session or create new one"""
-        if session_id not in self.sessions:
-            self.sessions[session_id] = ContextManager(
-                max_tokens=self.default_max_tokens,
-                reply_reserve_ratio=self.default_reply_reserve_ratio,
-                recent_window_size=self.default_recent_window_size
+    async def _condense(self, session_id: str, context_manager: ContextManager,
+                        model: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Condense a session and return the result with the context stats after it. The
+        stats are read here because a session evicted meanwhile is offloaded on the way
+        out, after which its instance may be reset and reused by another session.
+        """
+        try:
+            result = await context_manager.condense_context(
+                lambda prompt, history=None: self.llm_request(prompt, model, history)
             )
-        return self.sessions[session_id]
+            return result, context_manager.get_context_stats()
+        finally:
+            if self._evicted_condensing.get(session_id) is context_manager:
+                del self._evicted_condensing[session_id]
+                self._offload_session(session_id, context_manager)
     
-    async def llm_request(self, prompt: str, model: str = "qwen3:latest") -> str:
-        """Make a simple LLM request for context operations"""
+    async def llm_request(self,
+                          prompt: str,
+                          model: str = "qwen3:latest",
+                          history: Optional[List[Dict[str, str]]] = None) -> str:
+        """Make a simple LLM request for context operations
+        
+        ``history`` turns are sent ahead of the prompt unchanged, so repeated
+        calls over the same conversation reuse Ollama's cached prompt prefix.
+        """
+        messages = [*(history or ()), {"role": "user", "content": prompt}]
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.ollama_url,
-                    json={
-                        "model": model,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "stream": False
-                    },
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                
-                result = response.json()
-                return result.get("message", {}).get("content", "").strip()
-                
+            response = await self.client.post(
+                self.ollama_url,
+                json={
+                    "model": model,
+                    "messages": messages,
+                    "stream": False
+                }
+            )
+            response.raise_for_status()
+            
+            result = orjson.loads(response.content)
+            return result.get("message", {}).get("content", "").strip()
+            
         except Exception as e:
-            logger.error(f"LLM request failed: {e}")
+            logger.error("LLM request failed: %s", e)
             raise HTTPException(status_code=500, detail=f"LLM request failed: {str(e)}")
     
+    async def aclose(self):
+        """Close the pooled Ollama client and finish pending session file writes"""
+        await self.client.aclose()
+        await asyncio.get_running_loop().run_in_executor(None, self._file_io.shutdown, True)
+    
     async def add_message_to_context(self, 
                                    session_id: str,
                                    role: str, 
                                    content: str,
                                    model: str = "qwen3:latest") -> Dict[str, Any]:
         """Add a message to context and handle condensation if needed"""
-        context_manager = self.get_or_create_session(session_id)
+        context_manager = await self.get_or_create_session(session_id)
         
         # Validate and sanitize message using hygiene system
         validation = context_hygiene.validate_message(content, role)
@@ -81,22 +271,20 @@ class ContextService:
         # Add the message
         message = context_manager.add_message(role, final_content)
         
-        # Check for topic shifts
-        recent_messages = [
-            {'role': msg.role, 'content': msg.content} 
-            for msg in context_manager.messages[-3:]
-        ]
-        topic_shifted = context_hygiene.detect_topic_shift(recent_messages)
+        # Check for topic shifts. This is a few set operations over three messages, so
+        # it stays inline: a background task would still run on this event loop and
+        # cost more to schedule than the check itself
+        topic_shifted = context_hygiene.detect_topic_shift(
+            [msg.record for msg in context_manager.messages[-3:]]
+        )
         
         # Check if condensation is needed
         condensation_result = None
         if context_manager.needs_condensation():
-            condensation_result = await context_manager.condense_context(
-                lambda prompt: self.llm_request(prompt, model)
-            )
-        
-        # Get current context stats
-        stats = context_manager.get_context_stats()
+            condensation_result, stats = await self._condense(session_id, context_manager, model)
+        else:
+            # Get current context stats
+            stats = context_manager.get_context_stats()
         
         return {
             'message_added': {
@@ -117,7 +305,13 @@ class ContextService:
                                        current_query: str = "",
                                        include_stats: bool = False) -> Dict[str, Any]:
         """Build optimized conversation context for LLM"""
-        context_manager = self.get_or_create_session(session_id)
+        context_manager = await self.get_or_create_session(session_id)
+        
+        # Reuse the last result while the session is unchanged (e.g. a UI re-fetch)
+        cache_key = (context_manager.revision, current_query, include_stats)
+        cached = self._context_cache.get(session_id)
+        if cached is not None and cached[0] == cache_key:
+            return cached[1]
         
         # Build context messages
         context_messages = context_manager.build_context_for_llm(current_query)
@@ -126,17 +320,22 @@ class ContextService:
         validation = context_hygiene.validate_context_structure(context_messages)
         
         if not validation.is_valid:
-            logger.warning(f"Context validation issues: {validation.issues}")
+            logger.warning("Context validation issues: %s", validation.issues)
         
         # Optimize context ordering
         optimized_messages = context_hygiene.optimize_context_order(context_messages)
         
-        # Clean the conversation history
-        cleaned_messages = context_hygiene.clean_conversation_history(optimized_messages)
+        # Clean the conversation history, counting tokens in the same pass with the
+        # tokenizer Message uses (its counts are cached, so unchanged turns aren't re-encoded)
+        cleaned_messages = []
+        token_count = 0
+        for msg in context_hygiene.iter_clean_conversation_history(optimized_messages):
+            cleaned_messages.append(msg)
+            token_count += count_tokens(msg['content'])
         
         result = {
             'messages': cleaned_messages,
-            'token_count': sum(len(msg['content']) // 4 for msg in cleaned_messages),
+            'token_count': token_count,
             'hygiene_applied': True,
             'validation_warnings': validation.warnings if validation.warnings else None
         }
@@ -144,34 +343,33 @@ class ContextService:
         if include_stats:
             result['stats'] = context_manager.get_context_stats()
         
+        self._context_cache[session_id] = (cache_key, result)
         return result
     
     async def force_condensation(self,
                                session_id: str,
                                model: str = "qwen3:latest") -> Dict[str, Any]:
         """Force context condensation"""
-        context_manager = self.get_or_create_session(session_id)
+        context_manager = await self.get_or_create_session(session_id)
         
         if len(context_manager.messages) < 2:
             return {'action': 'no_condensation_needed', 'reason': 'insufficient_messages'}
         
-        result = await context_manager.condense_context(
-            lambda prompt: self.llm_request(prompt, model)
-        )
+        result, stats = await self._condense(session_id, context_manager, model)
         
         return {
             'condensation': result,
-            'context_stats': context_manager.get_context_stats()
+            'context_stats': stats
         }
     
-    def get_context_stats(self, session_id: str) -> Dict[str, Any]:
+    async def get_context_stats(self, session_id: str) -> Dict[str, Any]:
         """Get context statistics for a session"""
-        context_manager = self.get_or_create_session(session_id)
+        context_manager = await self.get_or_create_session(session_id)
         return context_manager.get_context_stats()
     
-    def get_session_memory(self, session_id: str) -> Dict[str, Any]:
+    async def get_session_memory(self, session_id: str) -> Dict[str, Any]:
         """Get session memory details"""
-        context_manager = self.get_or_create_session(session_id)
+        context_manager = await self.get_or_create_session(session_id)
         memory = context_manager.session_memory
         
         return {
@@ -185,11 +383,11 @@ class ContextService:
             'summary_version': memory.summary_version
         }
     
-    def update_session_memory(self,
+    async def update_session_memory(self,
                             session_id: str,
                             memory_updates: Dict[str, Any]) -> Dict[str, Any]:
         """Update session memory components"""
-        context_manager = self.get_or_create_session(session_id)
+        context_manager = await self.get_or_create_session(session_id)
         memory = context_manager.session_memory
         
         # Update allowed fields
@@ -200,43 +398,43 @@ class ContextService:
         
         # Special handling for constraints/decisions
         if 'add_constraint' in memory_updates:
-            memory.constraints_decisions.append(memory_updates['add_constraint'])
+            memory.add_constraint_decision(memory_updates['add_constraint'])
         
         if 'add_canonical_fact' in memory_updates:
             key = memory_updates['add_canonical_fact']['key']
             value = memory_updates['add_canonical_fact']['value']
             memory.canonical_facts[key] = value
         
-        return self.get_session_memory(session_id)
+        context_manager.revision += 1
+        
+        return await self.get_session_memory(session_id)
     
     def clear_session(self, session_id: str) -> Dict[str, str]:
         """Clear a session's context"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        context_manager = self.sessions.pop(session_id, None) or self._evicted_condensing.pop(session_id, None)
+        self._context_cache.pop(session_id, None)
+        if context_manager is not None:
+            self._pool.release(context_manager)
+        if self._session_path(session_id) is not None:
+            self._queue_file_op(session_id, None)
         
         return {'status': 'cleared', 'session_id': session_id}
     
-    def get_conversation_history(self, 
+    async def get_conversation_history(self, 
                                session_id: str,
                                limit: Optional[int] = None) -> Dict[str, Any]:
         """Get conversation history with metadata"""
-        context_manager = self.get_or_create_session(session_id)
+        context_manager = await self.get_or_create_session(session_id)
         
         messages = context_manager.messages
         if limit:
             messages = messages[-limit:]
+        salience_scores = context_manager.salience_scores(limit)
         
         return {
             'messages': [
-                {
-                    'id': msg.message_id,
-                    'role': msg.role,
-                    'content': msg.content,
-                    'timestamp': msg.timestamp,
-                    'tokens': msg.tokens,
-                    'salience_score': msg.salience_score
-                }
-                for msg in messages
+                {**msg.record, 'salience_score': salience_score}
+                for msg, salience_score in zip(messages, salience_scores)
             ],
             'total_messages': len(context_manager.messages),
             'context_chunks': len(context_manager.context_chunks),
@@ -248,23 +446,14 @@ class ContextService:
                                     query: str,
                                     max_results: int = 5) -> Dict[str, Any]:
         """Search conversation context semantically"""
-        context_manager = self.get_or_create_session(session_id)
+        context_manager = await self.get_or_create_session(session_id)
         
         # Get relevant chunks
         relevant_chunks = context_manager.semantic_retrieval(query, max_results)
         
         return {
             'query': query,
-            'results': [
-                {
-                    'content': chunk.content,
-                    'chunk_type': chunk.chunk_type,
-                    'timestamp': chunk.timestamp,
-                    'tokens': chunk.tokens,
-                    'message_ids': chunk.message_ids
-                }
-                for chunk in relevant_chunks
-            ],
+            'results': [chunk.record for chunk in relevant_chunks],
             'total_chunks_searched': len(context_manager.context_chunks),
             'results_returned': len(relevant_chunks)
         }
@@ -280,31 +469,13 @@ class ContextService:
             }
         }
     
-    def get_hygiene_report(self, session_id: str) -> Dict[str, Any]:
+    async def get_hygiene_report(self, session_id: str) -> Dict[str, Any]:
         """Generate context hygiene report for a session"""
-        context_manager = self.get_or_create_session(session_id)
-        
-        # Convert messages to dict format
-        messages = [
-            {
-                'role': msg.role,
-                'content': msg.content,
-                'timestamp': msg.timestamp,
-                'tokens': msg.tokens
-            }
-            for msg in context_manager.messages
-        ]
-        
-        # Convert context chunks to dict format
-        context_chunks = [
-            {
-                'content': chunk.content,
-                'chunk_type': chunk.chunk_type,
-                'timestamp': chunk.timestamp,
-                'tokens': chunk.tokens
-            }
-            for chunk in context_manager.context_chunks
-        ]
+        context_manager = await self.get_or_create_session(session_id)
+        
+        # Messages and chunks keep their API dicts; the report reads them in one pass
+        messages = (msg.record for msg in context_manager.messages)
+        context_chunks = (chunk.record for chunk in context_manager.context_chunks)
         
         # Get session memory
         memory = {
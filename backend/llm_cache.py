@@ -0,0 +1,138 @@
+"""
+LLM Response Cache
+TTL-bounded LRU cache for repeated Ollama requests, keyed on the request payload,
+plus single-flight coalescing of identical requests that are still in progress
+"""
+
+import asyncio
+import hashlib
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import orjson
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCache:
+    """
+    Cache of Ollama responses for identical request bodies. Used only from the
+    event loop thread and never awaits, so it needs no lock.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: int = 3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def make_key(body: Dict[str, Any]) -> str:
+        """Hash the full request body (model, messages, stream, options)"""
+        return hashlib.sha256(orjson.dumps(body, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._cache.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self._cache[key] = value
+
+
+class _Broadcast:
+    """Chunks of one upstream stream, replayable by any number of subscribers"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.done = False
+        self.subscribers = 0  # live readers; the upstream call is stopped when none are left
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self._notify()
+
+    def close(self) -> None:
+        self.done = True
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[bytes]:
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                return
+            await self._changed.wait()
+
+
+class SingleFlight:
+    """Share one upstream Ollama call between identical concurrent requests"""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, Tuple[_Broadcast, asyncio.Task]] = {}
+        self._tasks = set()
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await fn() once per key; concurrent callers get the same result. The call
+        runs in its own task, so a cancelled caller doesn't cancel the others.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish_call(key, done))
+        return await asyncio.shield(task)
+
+    def _finish_call(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved when every caller has gone away
+
+    async def stream(self, key: str, source: Callable[[], AsyncIterator[bytes]]) -> AsyncIterator[bytes]:
+        """Yield the chunks of source(), started at most once per key while in flight"""
+        entry = self._streams.get(key)
+        if entry is None:
+            broadcast = _Broadcast()
+            task = asyncio.create_task(self._pump(key, source, broadcast))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            entry = self._streams[key] = (broadcast, task)
+        broadcast, task = entry
+
+        broadcast.subscribers += 1
+        subscription = broadcast.subscribe()
+        try:
+            async for chunk in subscription:
+                yield chunk
+        finally:
+            await subscription.aclose()
+            broadcast.subscribers -= 1
+            if not broadcast.subscribers and not broadcast.done:
+                # Every reader went away: stop the Ollama call instead of letting it
+                # generate an answer nobody receives
+                if self._streams.get(key) is entry:
+                    del self._streams[key]
+                task.cancel()
+
+    async def _pump(self, key: str, source: Callable[[], AsyncIterator[bytes]], broadcast: _Broadcast):
+        try:
+            async for chunk in source():
+                broadcast.publish(chunk)
+        except Exception as e:
+            logger.error("Shared LLM stream failed: %s", e)
+        finally:
+            broadcast.close()
+            entry = self._streams.get(key)
+            if entry is not None and entry[0] is broadcast:
+                del self._streams[key]
+
+
+# Global instances
+llm_cache = LLMCache()
+llm_inflight = SingleFlight()
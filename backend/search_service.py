@@ -1,11 +1,128 @@
-import requests
+import httpx
 import json
-from typing import List, Dict, Optional
-from urllib.parse import quote_plus
+import math
+import re
+from typing import List, Dict, Optional, Tuple
+from urllib.parse import quote_plus, unquote
 import logging
+from bs4 import BeautifulSoup
+from cachetools import TTLCache
+from llm_cache import SingleFlight
+
+try:
+    # Optional: selectolax's lexbor engine parses and runs CSS selectors in C
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    # Optional: lxml gives BeautifulSoup a C parser when selectolax isn't installed
+    import lxml  # noqa: F401
+    BS4_PARSER = 'lxml'
+except ImportError:
+    BS4_PARSER = 'html.parser'
 
 logger = logging.getLogger(__name__)
 
+# Recent search results are reused for identical queries
+SEARCH_CACHE_SIZE = 512
+SEARCH_CACHE_TTL = 300  # seconds
+
+# Minimum relative score gap at the top-N cut-off for the local ranking to be trusted
+RANK_CONFIDENCE_GAP = 0.15
+
+def rank_results_bm25(query: str, results: List[Dict], max_results: int,
+                      k1: float = 1.5, b: float = 0.75) -> Tuple[List[Dict], bool]:
+    """
+    Rank search results against the query with Okapi BM25 over title + snippet.
+    Returns the reordered results and whether the top-N cut is clear enough to
+    skip the LLM ranking pass.
+    """
+    if not results:
+        return results, True
+
+    docs = [re.findall(r'\w+', f"{r['title']} {r['snippet']}".lower()) for r in results]
+    query_terms = set(re.findall(r'\w+', query.lower()))
+    n_docs = len(docs)
+    avgdl = sum(len(d) for d in docs) / n_docs or 1.0
+
+    doc_freq = {}
+    for doc in docs:
+        for term in query_terms.intersection(doc):
+            doc_freq[term] = doc_freq.get(term, 0) + 1
+
+    scores = []
+    for doc in docs:
+        tf = {}
+        for word in doc:
+            if word in query_terms:
+                tf[word] = tf.get(word, 0) + 1
+        score = 0.0
+        for term, freq in tf.items():
+            idf = math.log(1 + (n_docs - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += idf * freq * (k1 + 1) / (freq + k1 * (1 - b + b * len(doc) / avgdl))
+        scores.append(score)
+
+    order = sorted(range(n_docs), key=lambda i: scores[i], reverse=True)
+    ranked = [results[i] for i in order]
+
+    if n_docs <= max_results:
+        return ranked, True
+
+    top = scores[order[0]]
+    if top <= 0:
+        return ranked, False
+    gap = (scores[order[max_results - 1]] - scores[order[max_results]]) / top
+    return ranked, gap >= RANK_CONFIDENCE_GAP
+
+# HTML endpoints for the scraping fallback, in order. The full HTML page comes first
+# because it carries real snippets; lite rows only give the link text.
+FALLBACK_SEARCH_URLS = (
+    "https://html.duckduckgo.com/html/?q={query}",
+    "https://lite.duckduckgo.com/lite/?q={query}",
+)
+
+# (result block, title link, snippet) CSS selectors for different DuckDuckGo layouts;
+# the first set that yields linked results wins
+RESULT_SELECTORS = (
+    ('div.result', 'a.result__a', 'a.result__snippet'),
+    ('div.web-result', 'h2 a', '.result__snippet'),
+    ('div[class*="result"]', 'a[href]', '.snippet'),
+    ('tr', 'a.result-link', '.result-snippet'),  # For lite version
+    ('table tr', 'a[href*="uddg"]', 'td.result-snippet'),  # Alternative lite
+)
+
+# Target URL in a DuckDuckGo redirect link (//duckduckgo.com/l/?uddg=<encoded url>&rut=...)
+_UDDG_RE = re.compile(r'[?&]uddg=([^&]+)')
+
+def _select_results(page, result_selector: str, title_selector: str, snippet_selector: str,
+                    limit: int) -> Tuple[int, List[Tuple[str, str, Optional[str]]]]:
+    """
+    Match result blocks in a parsed page (selectolax or BeautifulSoup) and return the
+    number of blocks found plus (title, href, snippet) for the linked ones among the
+    first `limit`
+    """
+    links = []
+    if LexborHTMLParser is not None and isinstance(page, LexborHTMLParser):
+        blocks = page.css(result_selector)
+        for block in blocks[:limit]:
+            title_elem = block.css_first(title_selector)
+            href = title_elem.attributes.get('href') if title_elem is not None else None
+            if href:
+                snippet_elem = block.css_first(snippet_selector)
+                snippet = snippet_elem.text(strip=True) if snippet_elem is not None else None
+                links.append((title_elem.text(strip=True), href, snippet))
+        return len(blocks), links
+
+    blocks = page.select(result_selector)
+    for block in blocks[:limit]:
+        title_elem = block.select_one(title_selector)
+        if title_elem and title_elem.get('href'):
+            snippet_elem = block.select_one(snippet_selector)
+            snippet = snippet_elem.get_text(strip=True) if snippet_elem else None
+            links.append((title_elem.get_text(strip=True), title_elem.get('href', ''), snippet))
+    return len(blocks), links
+
 class SearchResult:
     def __init__(self, title: str, url: str, snippet: str, source: str = ""):
         self.title = title
@@ -23,10 +140,23 @@ class SearchResult:
 
 class SearchService:
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
+        # Async pooled client: searches don't block the event loop, and repeat
+        # searches reuse open connections to the DuckDuckGo hosts
+        self.client = httpx.AsyncClient(
+            headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+            },
+            timeout=httpx.Timeout(10.0, connect=3.0),
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=50),
+            http2=True,
+            follow_redirects=True,
+        )
+        self._cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+        self._inflight = SingleFlight()
+
+    async def aclose(self):
+        """Close the pooled HTTP client"""
+        await self.client.aclose()
 
     async def search_duckduckgo(self, query: str, max_results: int = 5) -> List[SearchResult]:
         """
@@ -37,7 +167,7 @@ class SearchService:
             encoded_query = quote_plus(query)
             url = f"https://api.duckduckgo.com/?q={encoded_query}&format=json&no_html=1&skip_disambig=1"
             
-            response = self.session.get(url, timeout=10)
+            response = await self.client.get(url)
             response.raise_for_status()
             
             data = response.json()
@@ -69,7 +199,7 @@ class SearchService:
             return results[:max_results]
             
         except Exception as e:
-            logger.error(f"DuckDuckGo search error: {e}")
+            logger.error("DuckDuckGo search error: %s", e)
             return await self._fallback_web_search(query, max_results)
 
     async def _fallback_web_search(self, query: str, max_results: int) -> List[SearchResult]:
@@ -77,74 +207,60 @@ class SearchService:
         Fallback search method using DuckDuckGo HTML scraping with improved parsing
         """
         try:
-            from bs4 import BeautifulSoup
-            
             encoded_query = quote_plus(query)
             
             # Try multiple DuckDuckGo endpoints
-            urls_to_try = [
-                f"https://html.duckduckgo.com/html/?q={encoded_query}",
-                f"https://lite.duckduckgo.com/lite/?q={encoded_query}",
-            ]
-            
-            for url in urls_to_try:
+            for url_template in FALLBACK_SEARCH_URLS:
+                url = url_template.format(query=encoded_query)
                 try:
-                    print(f"[DEBUG] Trying search URL: {url}")
-                    response = self.session.get(url, timeout=15)
+                    logger.debug("Trying search URL: %s", url)
+                    response = await self.client.get(url, timeout=httpx.Timeout(15.0, connect=3.0))
                     response.raise_for_status()
                     
-                    soup = BeautifulSoup(response.content, 'html.parser')
+                    if LexborHTMLParser is not None:
+                        page = LexborHTMLParser(response.content)
+                    else:
+                        page = BeautifulSoup(response.content, BS4_PARSER)
                     results = []
                     
-                    # Try multiple CSS selectors for different DuckDuckGo layouts
-                    selectors_to_try = [
-                        ('div.result', 'a.result__a', 'a.result__snippet'),
-                        ('div.web-result', 'h2 a', '.result__snippet'),  
-                        ('div[class*="result"]', 'a[href]', '.snippet'),
-                        ('tr', 'a.result-link', '.result-snippet'),  # For lite version
-                        ('table tr', 'a[href*="uddg"]', 'td.result-snippet'),  # Alternative lite
-                    ]
-                    
-                    for result_selector, title_selector, snippet_selector in selectors_to_try:
-                        result_divs = soup.select(result_selector)
-                        if result_divs:
-                            print(f"[DEBUG] Found {len(result_divs)} results using selector: {result_selector}")
+                    for result_selector, title_selector, snippet_selector in RESULT_SELECTORS:
+                        found, links = _select_results(
+                            page, result_selector, title_selector, snippet_selector, max_results
+                        )
+                        if found:
+                            logger.debug("Found %d results using selector: %s", found, result_selector)
                             
-                            for result_div in result_divs[:max_results]:
-                                title_elem = result_div.select_one(title_selector)
-                                snippet_elem = result_div.select_one(snippet_selector)
+                            for title, url, snippet in links:
+                                if snippet is None:
+                                    snippet = title
+                                
+                                # Unwrap DuckDuckGo redirect URLs to the decoded target
+                                redirect = _UDDG_RE.search(url)
+                                if redirect:
+                                    url = unquote(redirect.group(1))
                                 
-                                if title_elem and title_elem.get('href'):
-                                    title = title_elem.get_text(strip=True)
-                                    url = title_elem.get('href', '')
-                                    snippet = snippet_elem.get_text(strip=True) if snippet_elem else title
-                                    
-                                    # Clean up DuckDuckGo redirect URLs
-                                    if 'uddg=' in url:
-                                        url = url.split('uddg=')[1] if 'uddg=' in url else url
-                                    
-                                    if title and url:
-                                        results.append(SearchResult(
-                                            title=title[:200],  # Limit title length
-                                            url=url,
-                                            snippet=snippet[:300],  # Limit snippet length
-                                            source="DuckDuckGo Web"
-                                        ))
+                                if title and url:
+                                    results.append(SearchResult(
+                                        title=title[:200],  # Limit title length
+                                        url=url,
+                                        snippet=snippet[:300],  # Limit snippet length
+                                        source="DuckDuckGo Web"
+                                    ))
                             
                             if results:
-                                print(f"[DEBUG] Successfully extracted {len(results)} search results")
+                                logger.debug("Successfully extracted %d search results", len(results))
                                 return results[:max_results]
                     
                 except Exception as e:
-                    print(f"[DEBUG] Failed to get results from {url}: {e}")
+                    logger.warning("Failed to get results from %s: %s", url, e)
                     continue
             
             # If all URLs failed, return a helpful fallback
-            print(f"[DEBUG] All search methods failed for query: {query}")
+            logger.warning("All search methods failed for query: %s", query)
             return self._create_synthetic_results(query)
             
         except Exception as e:
-            logger.error(f"Complete fallback search error: {e}")
+            logger.error("Complete fallback search error: %s", e)
             return self._create_synthetic_results(query)
     
     def _create_synthetic_results(self, query: str) -> List[SearchResult]:
@@ -170,15 +286,30 @@ class SearchService:
         """
         Main search method - returns search results as dictionaries
         """
-        print(f"[SEARCH] Main search method called with query: '{query}', max_results: {max_results}")
+        logger.debug("Search called with query: %r, max_results: %d", query, max_results)
         if not query.strip():
-            print(f"[SEARCH] Empty query, returning empty list")
+            logger.debug("Empty query, returning empty list")
             return []
         
+        key = (query.strip().lower(), max_results)
+        cached = self._cache.get(key)
+        if cached is not None:
+            logger.debug("Search cache hit for %r", query)
+            return list(cached)
+        
+        # Identical concurrent searches share one round trip
+        dict_results = await self._inflight.run(
+            repr(key), lambda: self._search_and_cache(key, query, max_results)
+        )
+        return list(dict_results)
+    
+    async def _search_and_cache(self, key: Tuple[str, int], query: str, max_results: int) -> List[Dict]:
         results = await self.search_duckduckgo(query, max_results)
-        print(f"[SEARCH] search_duckduckgo returned {len(results)} results")
+        logger.debug("search_duckduckgo returned %d results", len(results))
         dict_results = [result.to_dict() for result in results]
-        print(f"[SEARCH] Converted to {len(dict_results)} dictionary results")
+        # Synthetic "search failed" results aren't cached, so the next search retries
+        if not (dict_results and dict_results[0]["source"] == "Fallback"):
+            self._cache[key] = dict_results
         return dict_results
 
 # Global search service instance
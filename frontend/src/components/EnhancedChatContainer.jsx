@@ -138,6 +138,8 @@ function EnhancedChatContainer() {
       let isInThinking = false
       let currentThinking = ''
       let streamingMessageCreated = false
+      let searchQuery = text
+      let searchResults = []
 
       while (true) {
         const { done, value } = await reader.read()
@@ -153,11 +155,24 @@ function EnhancedChatContainer() {
           try {
             const data = JSON.parse(line)
             
-            if (data.search_results) {
+            // Search results arrive as a header frame followed by one frame per result
+            if (data.type === 'meta') {
+              searchQuery = data.query
+              searchResults = []
               addMessage('search', JSON.stringify({
-                query: data.query,
-                results: data.search_results,
-                count: data.search_results.length
+                query: searchQuery,
+                results: searchResults,
+                count: 0
+              }))
+              continue
+            }
+
+            if (data.search_result) {
+              searchResults = [...searchResults, data.search_result]
+              updateLastMessage(JSON.stringify({
+                query: searchQuery,
+                results: searchResults,
+                count: searchResults.length
               }))
               continue
             }